@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# number of colors whose acceptabilities are kept
+acc_cache_size = 256
+
+
+class AccCache:
+    """
+    Bounded LRU cache of the acceptabilities of all prototypes of a model for single colors.
+    Every prototype has a version counter that is increased by bump() when the learning changed it. An entry
+    keeps the versions its values were computed with, so only prototypes whose version changed since then are
+    recomputed for a cached color. As a guard against changes made directly on the DataFrame (e.g. by the
+    learning.execute_* functions), acc() also compares the parameters with the ones of its last call and bumps
+    the prototypes that differ. hits and misses count prototype/color pairs and can be used to size the cache.
+    invalidate() forgets all entries, e.g. when the knowledge base is reloaded.
+    The cache can be shared by several threads.
+    """
+
+    def __init__(self, size=acc_cache_size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.names: pd.Index = None
+        self.versions: np.ndarray = None
+        self.parameters: np.ndarray = None
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, names: list):
+        with self.lock:
+            if self.names is not None:
+                rows = self.names.get_indexer(names)
+                self.versions[rows[rows >= 0]] += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.names = None
+            self.versions = None
+            self.parameters = None
+
+    def acc(self, names: pd.Index, parameters: np.ndarray, colors: np.ndarray, lower_bound: float, compute):
+        """
+        Acceptabilities of the shape (prototypes, colors) for colors of the shape (colors, 3) and the current parameters (prototypes, 6).
+        compute(rows, colors) has to return the acceptabilities of the prototypes selected by rows
+        (a boolean mask, None for all prototypes) for the given colors.
+        """
+        with self.lock:
+            if self.names is None or not self.names.equals(names):
+                self.entries.clear()
+                self.names = names
+                self.versions = np.zeros(len(names), dtype=int)
+                self.parameters = None
+
+            if self.parameters is not None:
+                unchanged = (parameters == self.parameters) | (np.isnan(parameters) & np.isnan(self.parameters))
+                self.versions[~unchanged.all(axis=1)] += 1
+            self.parameters = parameters.copy()
+
+            result = np.empty((len(names), len(colors)))
+            missing = []
+            for i, color in enumerate(colors):
+                key = (tuple(color), lower_bound)
+                entry = self.entries.get(key)
+                if entry is None:
+                    missing.append(i)
+                    continue
+
+                self.entries.move_to_end(key)
+                stale = entry['versions'] != self.versions
+                if stale.any():
+                    entry['acc'][stale] = compute(stale, color[np.newaxis])[:, 0]
+                    entry['versions'] = self.versions.copy()
+                self.hits += int(len(stale) - stale.sum())
+                self.misses += int(stale.sum())
+                result[:, i] = entry['acc']
+
+            if missing:
+                acc = compute(None, colors[missing])
+                for column, i in enumerate(missing):
+                    self.entries[(tuple(colors[i]), lower_bound)] = {'versions': self.versions.copy(), 'acc': acc[:, column].copy()}
+                    result[:, i] = acc[:, column]
+                self.misses += acc.size
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return result
+
+    def stats(self):
+        return {'hits': int(self.hits), 'misses': int(self.misses), 'entries': len(self.entries), 'size': self.size}
@@ -0,0 +1,351 @@
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import subprocess
+import numpy as np
+
+
+"""
+Benchmarks of the program. Run from the directory containing colorful:
+        python colorful/benchmark.py                        runs all benchmarks and stores the results as JSON in benchmark_dir
+        python colorful/benchmark.py compare old.json new.json   compares the results of two runs
+        python colorful/benchmark.py solvers                runs only the comparison of the solvers on the bundled logs
+
+The learning benchmarks use the current values of model.alpha, model.lower_bound, learning.aimed_difference and
+learning.convergence_tolerance, they are stored with the results, so the cost of tuning them can be compared.
+
+import_modules: the entry points whose import time is measured, each in a fresh interpreter
+heavy_modules: modules that must not be loaded by importing an entry point, they are loaded on first use
+import_time_budget: the highest allowed import time of an entry point in seconds (checked by test_imports.py)
+knowledge_bases: the knowledge bases the scoring and learning is measured on
+synthetic_sizes: number of categories of the generated knowledge bases (stored in synthetic_dir)
+scene_number: number of scenes fitted and learned per knowledge base and learning mode
+solver_logs: the bundled logs replayed to compare the Gauss-Newton solver with SLSQP
+solver_entries: number of entries replayed per log and learning mode
+"""
+
+
+# ---------------------- #
+import_modules = ['main', 'simulator', 'model', 'logdecoder']
+heavy_modules = ['scipy.optimize', 'scipy.stats', 'matplotlib', 'tkinter', 'PIL']
+import_time_budget = 1.0
+repeat = 5
+knowledge_bases = ['colorful/knowledge_base/kb_colors_preset.csv', 'colorful/knowledge_base/kb_colors_mast_wolter.csv']
+synthetic_sizes = [300, 3000]
+scene_number = 30
+change_limit = 750
+seed = 0
+solver_logs = [str(log_id) for log_id in range(1, 13)]
+solver_entries = 60
+benchmark_dir = 'colorful/benchmarks'
+synthetic_dir = 'colorful/.cache/benchmark'
+# ---------------------- #
+
+
+source_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, source_dir)
+
+
+# ======================================
+# ============== Imports ===============
+# ======================================
+
+def measure_import(module, repeat=repeat):
+    code = (f"import sys, time; sys.path.insert(0, {source_dir!r}); start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start); print(','.join(m for m in {heavy_modules!r} if m in sys.modules))")
+
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split('\n')
+        times.append(float(output[0]))
+        loaded = [m for m in output[1].split(',') if m]
+
+    # the minimum is the least disturbed measurement
+    return {'seconds': min(times), 'heavy_modules': loaded}
+
+def benchmark_imports(budget=import_time_budget):
+    # only reports the import times, the budget and the heavy modules are checked by test_imports.py
+    results = {module: measure_import(module) for module in import_modules}
+    for module, result in results.items():
+        over_budget = ' over budget' if result['seconds'] > budget else ''
+        print(f"import {module}: {result['seconds']:.3f}s{over_budget} {result['heavy_modules'] or ''}")
+    return results
+
+# ======================================
+# ========== Scoring/Learning ==========
+# ======================================
+
+def timing(times: list[float]):
+    times = np.array(times)
+    return {'calls': len(times), 'total': times.sum(), 'mean': times.mean(), 'median': np.median(times), 'min': times.min(), 'max': times.max()}
+
+def synthetic_knowledge_base(size, seed=seed):
+    # prototypes with random centers and radii similar to the preset, stored as csv to be loaded like the bundled ones
+    path = f'{synthetic_dir}/kb_colors_synthetic_{size}_{seed}.csv'
+    if not os.path.exists(path):
+        import pandas as pd
+
+        rng = np.random.default_rng(seed)
+        frame = pd.DataFrame({
+            'hc': rng.uniform(0, 360, size), 'hr': rng.uniform(5, 40, size),
+            'sc': rng.uniform(20, 100, size), 'sr': rng.uniform(10, 50, size),
+            'lc': rng.uniform(10, 90, size), 'lr': rng.uniform(5, 30, size),
+        }, index=pd.Index([f'synthetic{i}' for i in range(size)], name='colorname'))
+        os.makedirs(synthetic_dir, exist_ok=True)
+        frame.to_csv(path)
+    return path
+
+def benchmark_scenes(model, number=scene_number, seed=seed, radius_portion=1.2):
+    # two colors next to a random prototype like colors.two_adjacent_colors, prototypes without hue get a random hue
+    from colors import Color
+
+    rng = np.random.default_rng(seed)
+    rows = model.iloc[rng.integers(len(model), size=number)]
+    hc = np.where(rows['hc'].isna(), rng.uniform(0, 360, number), rows['hc'])
+    hr = rows['hr'].fillna(180).to_numpy()
+    h0 = hc + hr * rng.uniform(-1, 1, number)
+    h1 = h0 + hr * radius_portion * rng.choice([-1, 1], number)
+
+    scenes = []
+    for i, (_, row) in enumerate(rows.iterrows()):
+        s = np.clip(row['sc'] + row['sr'] * rng.uniform(-1, 1, 2), 0, 100)
+        l = np.clip(row['lc'] + row['lr'] * rng.uniform(-1, 1, 2), 0, 100)
+        scenes.append([Color(int(h0[i]) % 360, int(s[0]), int(l[0])), Color(int(h1[i]) % 360, int(s[1]), int(l[1]))])
+    return scenes
+
+def benchmark_knowledge_base(path):
+    import model
+    # loaded on first use by the learning functions, not part of the measured calls
+    import scipy.optimize
+    import scipy.stats
+
+    color_model = model.ColorModel(path)
+    scenes = benchmark_scenes(color_model.model)
+
+    times = []
+    labels = []
+    for colors in scenes:
+        start = time.perf_counter()
+        color_model.fit_colors(colors)
+        times.append(time.perf_counter() - start)
+        # the second best category as the description of the first color, so that learning is needed
+        labels.append(color_model.model['acc0'].nlargest(2).index[-1])
+    results = {'categories': len(color_model.model), 'fit_colors': timing(times)}
+
+    for learn_mode in ['statistical', 'naive', 'context-sensitive']:
+        color_model.reload_model()
+        times = []
+        statuses = {}
+        evaluations = []
+        for colors, label in zip(scenes, labels):
+            color_model.fit_colors(colors)
+            start = time.perf_counter()
+            if learn_mode == 'statistical':
+                outcome = color_model.statistical_learning(label, colors, 0, change_limit)
+            elif learn_mode == 'naive':
+                outcome = color_model.naive_learning(colors, [label, None], change_limit)
+            else:
+                outcome = color_model.context_sensitive_learning(colors, [label, None], change_limit)
+            times.append(time.perf_counter() - start)
+
+            statuses[outcome['status']] = statuses.get(outcome['status'], 0) + 1
+            if outcome.get('solver'):
+                evaluations.append(outcome['solver']['nfev'])
+        results[learn_mode] = timing(times) | {'statuses': statuses, 'mean_evaluations': np.mean(evaluations) if evaluations else None}
+
+    print(f"{os.path.basename(path)}: " + ', '.join(f"{key} {value['mean'] * 1000:.2f}ms" for key, value in results.items() if isinstance(value, dict)))
+    return results
+
+def benchmark_solvers(log_ids=solver_logs, entries=solver_entries):
+    # every learning problem of the replayed logs is solved by both solvers from the same model state,
+    # the replay continues with the SLSQP result like the default replays
+    import contextlib
+    import io
+    import model
+    import logdecoder
+
+    problems = []
+    for log_id in log_ids:
+        for learn_mode in ['naive', 'context-sensitive']:
+            color_model = model.ColorModel()
+            # a cached solution would skip the solver
+            color_model.solution_cache.size = 0
+            for entry in logdecoder.decode_log(log_id)[:entries]:
+                labels = [None] * len(entry.colors)
+                labels[entry.target_index] = entry.input
+                problem = {}
+                for solver in ['gauss-newton', 'slsqp']:
+                    model_before = color_model.model.copy()
+                    color_model.fit_colors(entry.colors)
+                    metrics = color_model.start_step()
+                    learn = color_model.naive_learning if learn_mode == 'naive' else color_model.context_sensitive_learning
+                    # the learning functions print the adjusted prototypes
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        outcome = learn(entry.colors, labels, change_limit, solver=solver)
+                    problem[solver] = {'status': outcome['status'], 'border_change': outcome['border_change'],
+                                       'minimize': metrics.timings.get('minimize', 0), 'solved': 'solver' in outcome}
+                    if solver != 'slsqp':
+                        color_model.model = model_before
+                if problem['slsqp']['solved']:
+                    problems.append(problem)
+
+    results = {'logs': list(log_ids), 'entries': entries, 'problems': len(problems)}
+    for solver in ['gauss-newton', 'slsqp']:
+        statuses = {}
+        for problem in problems:
+            statuses[problem[solver]['status']] = statuses.get(problem[solver]['status'], 0) + 1
+        failures = statuses.get('not_successful', 0)
+        results[solver] = {'statuses': statuses, 'failures': failures, 'failure_rate': failures / max(len(problems), 1),
+                           'minimize': timing([problem[solver]['minimize'] for problem in problems] or [0])}
+
+    # border change of Gauss-Newton relative to SLSQP where both changed the model
+    ratios = [problem['gauss-newton']['border_change'] / problem['slsqp']['border_change'] for problem in problems
+              if problem['gauss-newton']['status'] == problem['slsqp']['status'] == 'changed' and problem['slsqp']['border_change'] > 0]
+    results['agreement'] = {
+        'same_status': sum(problem['gauss-newton']['status'] == problem['slsqp']['status'] for problem in problems),
+        'both_changed': len(ratios),
+        'change_ratio': {'median': np.median(ratios), 'p10': np.percentile(ratios, 10), 'p90': np.percentile(ratios, 90)} if ratios else None,
+    }
+
+    ratio = results['agreement']['change_ratio']
+    print(f"solvers: {len(problems)} problems, failures gauss-newton {results['gauss-newton']['failures']} slsqp {results['slsqp']['failures']}, "
+          f"same status {results['agreement']['same_status']}, both changed {len(ratios)}"
+          + (f" (change ratio median {ratio['median']:.3f}, p10/p90 {ratio['p10']:.3f}/{ratio['p90']:.3f})" if ratio else '')
+          + f", minimize gauss-newton {results['gauss-newton']['minimize']['mean'] * 1000:.2f}ms slsqp {results['slsqp']['minimize']['mean'] * 1000:.2f}ms")
+    return results
+
+# ======================================
+# ============ Logs/Plots ==============
+# ======================================
+
+def benchmark_logs():
+    import logdecoder
+
+    paths = sorted(glob.glob('colorful/logs/log*.log'))
+    log_ids = [os.path.basename(path)[len('log'):-len('.log')] for path in paths]
+
+    start = time.perf_counter()
+    entries = sum(len(logdecoder.parse_log(path)['target_index']) for path in paths)
+    parse_time = time.perf_counter() - start
+
+    # the first pass fills the disk cache if it is missing, the second one reads it
+    for log_id in log_ids:
+        logdecoder.decode_log(log_id)
+    logdecoder._index_memory.clear()
+    start = time.perf_counter()
+    for log_id in log_ids:
+        logdecoder.decode_log(log_id)
+    disk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for log_id in log_ids:
+        logdecoder.decode_log(log_id)
+    memory_time = time.perf_counter() - start
+
+    print(f"logs: {len(paths)} logs, {entries} entries, parse {parse_time:.3f}s, disk cache {disk_time:.3f}s, memory cache {memory_time:.3f}s")
+    return {'logs': len(paths), 'entries': entries, 'parse_log': parse_time, 'decode_log_disk_cache': disk_time, 'decode_log_memory_cache': memory_time}
+
+def benchmark_rendering(repeat=repeat):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import model
+    import visualization
+
+    color_model = model.ColorModel()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # writes output.png, plt.show() does nothing with the Agg backend
+        visualization.show(color_model.model, color_model.base_model)
+        times.append(time.perf_counter() - start)
+        plt.close('all')
+
+    renderer = visualization.FrameRenderer(f'{synthetic_dir}/frames')
+    frame_times = []
+    for colors in benchmark_scenes(color_model.model, repeat):
+        color_model.fit_colors(colors)
+        model_before = color_model.model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].copy()
+        color_model.context_sensitive_learning(colors, [color_model.best_descriptions(2)[1], None], change_limit)
+        start = time.perf_counter()
+        renderer.render(color_model.model, model_before, colors, 0)
+        frame_times.append(time.perf_counter() - start)
+
+    results = {'show': timing(times), 'render_frame': timing(frame_times)}
+    print(f"rendering: show {results['show']['mean']:.3f}s, frame {results['render_frame']['mean']:.3f}s")
+    return results
+
+# ======================================
+# ============== Results ===============
+# ======================================
+
+def run(path=None):
+    import contextlib
+    import io
+    import model
+    import learning
+
+    commit = subprocess.run(['git', '-C', source_dir, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    results = {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'parameters': {'alpha': model.alpha, 'lower_bound': model.lower_bound, 'aimed_difference': learning.aimed_difference,
+                       'convergence_tolerance': learning.convergence_tolerance, 'scene_number': scene_number, 'seed': seed},
+        'imports': benchmark_imports(),
+        'knowledge_bases': {},
+    }
+
+    paths = knowledge_bases + [synthetic_knowledge_base(size) for size in synthetic_sizes]
+    for kb_path in paths:
+        # the learning functions print the adjusted prototypes
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            result = benchmark_knowledge_base(kb_path)
+        print(output.getvalue().splitlines()[-1])
+        results['knowledge_bases'][os.path.basename(kb_path)] = result
+    results['solvers'] = benchmark_solvers()
+    results['logs'] = benchmark_logs()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        results['rendering'] = benchmark_rendering()
+    print(output.getvalue().splitlines()[-1])
+
+    if path is None:
+        path = f"{benchmark_dir}/benchmark_{commit or 'unknown'}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, default=float)
+    print(f"Results written to {path}")
+    return results
+
+def compare(old_path, new_path):
+    # prints the ratio new / old of every timing present in both runs
+    with open(old_path, encoding='utf-8') as file:
+        old = _flatten(json.load(file))
+    with open(new_path, encoding='utf-8') as file:
+        new = _flatten(json.load(file))
+
+    for key in old:
+        if key in new and key.split('/')[-1] in ('mean', 'seconds', 'parse_log', 'decode_log_disk_cache', 'decode_log_memory_cache') and old[key]:
+            print(f"{key}: {old[key]:.4f}s -> {new[key]:.4f}s ({new[key] / old[key]:.2f}x)")
+
+def _flatten(results: dict, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 2 and sys.argv[1] == 'solvers':
+        benchmark_solvers()
+    else:
+        run()
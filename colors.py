@@ -1,6 +1,7 @@
 import colorsys
 import random
 import math
+import numpy as np
 import pandas as pd
 
 class Color:
@@ -48,3 +49,41 @@ def two_adjacent_colors(model: pd.DataFrame, radius_portion=1.2):
     random.shuffle(colors)
 
     return colors
+
+
+def adjacent_color_scenes(model: pd.DataFrame, number: int, rng: np.random.Generator, radius_portion=1.2):
+    """
+    Generates number scenes like two_adjacent_colors at once from an explicit random generator, so the scenes
+    can be reproduced. Returns the scenes as an array of the shape (number, 2, 3) with the HSL values of both colors
+    (see model.name_scenes) and the target index of every scene. Prototypes without hue get a random hue and radius 180.
+    """
+    rows = rng.integers(len(model), size=number)
+    hc = model['hc'].to_numpy(dtype=float)[rows]
+    hc = np.where(np.isnan(hc), rng.uniform(0, 360, number), hc)
+    hr = np.nan_to_num(model['hr'].to_numpy(dtype=float)[rows], nan=180)
+    add_diversity = model['add_diversity'].to_numpy(dtype=float)[rows] if 'add_diversity' in model else np.zeros(number)
+
+    h_deviation = rng.uniform(-1, 1, number)
+    h1 = np.trunc(hc + hr * h_deviation).astype(int) % 360
+    # -1 goes left, 1 goes right
+    direction = rng.choice([-1, 1], number)
+    h2 = np.trunc(hc + hr * (h_deviation + direction * radius_portion) + direction * add_diversity).astype(int) % 360
+
+    scenes = np.empty((number, 2, 3), dtype=int)
+    scenes[:, :, 0] = np.stack([h1, h2], axis=1)
+    scenes[:, :, 1] = 100
+    scenes[:, :, 2] = rng.integers(30, 61, size=(number, 2))
+
+    # random order of the two colors
+    swap = rng.random(number) < 0.5
+    scenes[swap] = scenes[swap, ::-1]
+
+    return scenes, rng.integers(2, size=number)
+
+def scene_streams(seed, number: int):
+    # independent and reproducible random generators, e.g. one per worker of a parallel simulation
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(number)]
+
+def scene_colors(scene: np.ndarray):
+    # the colors of one generated scene
+    return [Color(int(h), int(s), int(l)) for h, s, l in scene]
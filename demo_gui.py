@@ -0,0 +1,27 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class DemoGui(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("Colorful")
+
+        self.canvas_size = 400
+        self.canvas = tk.Canvas(self, width=self.canvas_size, height=self.canvas_size)
+        self.canvas.pack(expand=tk.YES, fill=tk.BOTH)
+
+        self.description = tk.StringVar()
+        label = ttk.Label(self, textvariable=self.description, wraplength=self.canvas_size)
+        label.pack(padx=10, fill='x', expand=True)
+
+    def draw(self, colors, target_index, input):
+        self.description.set(input)
+
+        self.canvas.delete('all')
+        self.canvas.create_oval(50, 50, 150, 150, width=2, fill=colors[0].html())
+        self.canvas.create_oval(250, 50, 350, 150, width=2, fill=colors[1].html())
+
+        # draw indication arrow
+        arrowX = 100 if target_index == 0 else 300
+        self.canvas.create_line(arrowX, 250, arrowX, 180, width=3, arrow='last', arrowshape=(16, 20, 6))
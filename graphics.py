@@ -1,12 +1,12 @@
 """This script is used to create artificial program runs to create graphics for the thesis."""
 
 import numpy as np
-import matplotlib as plt
+import matplotlib.pyplot as plt
 import itertools
 
 import model
 import learning
-from logdecoder import decode_log, determine_errors
+from logdecoder import load_log_index
 from colors import Color
 
 def robustness_statistical():
@@ -40,20 +40,16 @@ def robustness_sensitive_neg():
     model.show_comparision()
 
 def make_subplot(title, collection, start_index, end_index, plot_rows, plot_cols, plot_number, ylim):
-    collection_entries = [decode_log(id) for id in collection]
-    collection_errors = [determine_errors(id) for id in collection]
+    collection_logs = [load_log_index(id) for id in collection]
 
     x = range(0, end_index)
-    y = [0] * end_index
+    y = np.zeros(end_index)
 
-    for entry_list, error_list in zip(collection_entries, collection_errors):
-        for index, entry in enumerate(entry_list[:end_index]):
-            if error_list[index]:
-                y[index] += 750
-            else:
-                y[index] += entry.change_borders
+    for log in collection_logs:
+        change_borders = np.where(log['errors'], 750, log['change_borders'])[:end_index]
+        y[:len(change_borders)] += change_borders
 
-    y = [value / len(collection_entries) for value in y]
+    y = y / len(collection_logs)
 
     print(sum(y) / len(y))
 
@@ -70,17 +66,16 @@ def make_subplot(title, collection, start_index, end_index, plot_rows, plot_cols
     plt.ylim((0, ylim))
 
 def make_error_subplot(collection, start_index, end_index, plot_rows, plot_cols, plot_number, ylim):
-    collection_errors = [determine_errors(id) for id in collection]
+    collection_logs = [load_log_index(id) for id in collection]
 
     x = range(0, end_index)
-    y = [0] * end_index
+    y = np.zeros(end_index)
 
-    for error_list in collection_errors:
-        for index, error in enumerate(error_list[:end_index]):
-            if error:
-                y[index] += 1
+    for log in collection_logs:
+        errors = log['errors'][:end_index]
+        y[:len(errors)] += errors
 
-    y = [value / len(collection_errors) for value in y]
+    y = y / len(collection_logs)
 
     m, t = np.polyfit(x[start_index : end_index], y[start_index : end_index], deg=1)
 
@@ -95,17 +90,16 @@ def make_error_subplot(collection, start_index, end_index, plot_rows, plot_cols,
     plt.ylabel("Percentage of Failed Adaptions")
 
 def make_prediction_subplot(title, collection, start_index, end_index, plot_rows, plot_cols, plot_number, ylim):
-    collection_entries = [decode_log(id) for id in collection]
+    collection_logs = [load_log_index(id) for id in collection]
 
     x = range(0, end_index)
-    y = [0] * end_index
+    y = np.zeros(end_index)
 
-    for entry_list in collection_entries:
-        for index, entry in enumerate(entry_list[:end_index]):
-            if entry.correct_pred:
-                y[index] += 1
+    for log in collection_logs:
+        correct_pred = log['correct_pred'][:end_index]
+        y[:len(correct_pred)] += correct_pred
 
-    y = [value / len(collection_entries) for value in y]
+    y = y / len(collection_logs)
 
     print(sum(y) / len(y))
 
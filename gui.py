@@ -3,14 +3,22 @@ import tkinter as tk
 from tkinter import ttk
 import logging
 import random
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from colors import *
 import model
 from logdecoder import Entry
+from learning import learning_outcome
+from records import RecordWriter, interaction_record
 
 
+# milliseconds between two checks whether the learning in the background finished
+poll_interval = 20
+
 class App(tk.Tk):
-    def __init__(self, log_id, open_log_mode):
+    def __init__(self, log_id, open_log_mode, write_records=False, profile_steps=False):
         super().__init__()
         self.title("Colorful")
 
@@ -29,6 +37,14 @@ class App(tk.Tk):
         self.log_id = log_id
         self.learn_mode = 'context-sensitive'
         logging.basicConfig(filename=f'colorful/logs/log{log_id}.log', filemode=open_log_mode, level=logging.INFO, format='%(message)s', encoding='utf-8')
+        self.records = RecordWriter(log_id, open_log_mode) if write_records else None
+        self.profile_steps = profile_steps
+        self.step_metrics = None
+
+        # learning and the scoring of the next scene run on one worker thread, so the window does not freeze
+        # and the model is never learned and scored at the same time
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.prefetched = None
 
         self.validation_entries: list[Entry] = []
         self.validation_iterator = iter(self.validation_entries)
@@ -89,26 +105,57 @@ class App(tk.Tk):
             self.new_validation()
 
     def new_learn(self):
-        self.colors = two_adjacent_colors(model.model, radius_portion=1.2)
-        self.target_index = random.randint(0, len(self.colors) - 1)
+        self.colors, self.target_index = self.next_scene()
         self.draw()
+        self.description.set(self.learn_prompt(self.target_index))
+        self.score_scene()
+
+    def next_scene(self):
+        # the prefetched scene if there is one
+        if self.prefetched is not None:
+            scene = self.prefetched.result()
+            self.prefetched = None
+            return scene
+        return self.generate_scene()
+
+    def generate_scene(self):
+        colors = two_adjacent_colors(model.model, radius_portion=1.2)
+        return colors, random.randint(0, len(colors) - 1)
+
+    def prefetch_scene(self):
+        # runs on the worker while the participant answers, the scene is generated and scored with the model before the answer
+        colors, target_index = self.generate_scene()
+        model.prefetch_colors(colors)
+        return colors, target_index
+
+    def discard_prefetched(self):
+        if self.prefetched is not None:
+            self.prefetched.result()
+            self.prefetched = None
+
+    def learn_prompt(self, target_index):
+        return f"Mit welcher Farbe würdest du die {'LINKE' if target_index == 0 else 'RECHTE'} Scheibe beschreiben, um sie eindeutig zu identifizieren und von der anderen Scheibe abzugrenzen?"
+
+    def score_scene(self):
+        self.step_metrics = model.start_step(self.profile_steps)
         model.fit_colors(self.colors)
+        self.fit_time = self.step_metrics.timings['fit_colors']
 
         self.log_colors()
         print(model.model)
 
-        best_desc = model.best_descriptions_naive(len(self.colors))
+        self.naive_desc = model.best_descriptions_naive(len(self.colors))
         for i in range(len(self.colors)):
-            print(best_desc[i])
+            print(self.naive_desc[i])
         print("---")
 
-        best_desc = model.best_descriptions(len(self.colors))
+        self.context_desc = model.best_descriptions(len(self.colors))
         for i in range(len(self.colors)):
-            print(best_desc[i])
+            print(self.context_desc[i])
         print("---")
 
-        self.description.set(f"Mit welcher Farbe würdest du die {'LINKE' if self.target_index == 0 else 'RECHTE'} Scheibe beschreiben, um sie eindeutig zu identifizieren und von der anderen Scheibe abzugrenzen?")
         self.entry.bind('<Return>', self.new_learn_entry)
+        self.prefetched = self.worker.submit(self.prefetch_scene)
 
     def new_learn_entry(self, _):
         text = self.input.get().lower()
@@ -123,29 +170,67 @@ class App(tk.Tk):
         elif self.set_learn_mode(text):
             pass
         elif text == '?':
+            # the next scene has to be generated with the increased diversity
+            self.discard_prefetched()
             model.indistinguishable_colors(self.target_index)
             logging.info(f"Indistinguishable!")
             logging.info("---")
+            self.write_record(text, learning_outcome('indistinguishable', 0, {}), 0)
             self.new_learn()
         else:
             logging.info(f"Input: {text}")
+            if not model.colorname_exists(text):
+                return
+
+            # inputs are ignored until the learning finished
+            self.entry.unbind('<Return>')
+            learning = self.worker.submit(self.learn, text, self.colors, self.target_index, self.learn_mode)
 
-            if self.learn_mode == 'statistical':
-                model.statistical_learning(text, self.colors, self.target_index)
-            elif self.learn_mode == 'naive':
-                color_labels = [None] * 2
-                color_labels[self.target_index] = text
-                model.naive_learning(self.colors, color_labels=color_labels)
-            elif self.learn_mode == 'context-sensitive':
-                color_labels = [None] * 2
-                color_labels[self.target_index] = text
-                model.context_sensitive_learning(self.colors, color_labels=color_labels)
-            else:
-                print('Unknown learn mode! No learning executed!')
-            
-            if model.colorname_exists(text):
-                logging.info("---")
-                self.new_learn()
+            # the next scene is shown right away and scored when the learning finished
+            scene = self.next_scene()
+            self.draw(colors=scene[0], target_index=scene[1])
+            self.description.set(self.learn_prompt(scene[1]))
+            self.after(poll_interval, self.finish_learn, learning, text, scene)
+
+    def learn(self, text, colors, target_index, learn_mode):
+        # runs on the worker
+        start = time.perf_counter()
+        outcome = None
+        if learn_mode == 'statistical':
+            outcome = model.statistical_learning(text, colors, target_index)
+        elif learn_mode == 'naive':
+            color_labels = [None] * len(colors)
+            color_labels[target_index] = text
+            outcome = model.naive_learning(colors, color_labels=color_labels)
+        elif learn_mode == 'context-sensitive':
+            color_labels = [None] * len(colors)
+            color_labels[target_index] = text
+            outcome = model.context_sensitive_learning(colors, color_labels=color_labels)
+        else:
+            print('Unknown learn mode! No learning executed!')
+        return outcome, time.perf_counter() - start
+
+    def finish_learn(self, learning, text, scene):
+        # called by the event loop until the learning finished
+        if not learning.done():
+            self.after(poll_interval, self.finish_learn, learning, text, scene)
+            return
+
+        error = learning.exception()
+        if error is None:
+            outcome, learn_time = learning.result()
+        else:
+            # the model is not changed and the participant continues with the next scene
+            traceback.print_exception(error)
+            logging.info(f"Learning failed: {type(error).__name__}: {error}. Model not changed.")
+            outcome, learn_time = learning_outcome('error', 0, {}), 0
+            outcome['error'] = f"{type(error).__name__}: {error}"
+        print(f"Metrics: {self.step_metrics}")
+        logging.info("---")
+        self.write_record(text, outcome, learn_time)
+
+        self.colors, self.target_index = scene
+        self.score_scene()
 
     def set_learn_mode(self, learn_mode):
         if learn_mode in ['statistical!', 'naive!', 'context-sensitive!']:
@@ -156,21 +241,31 @@ class App(tk.Tk):
 
         return False
 
+    def write_record(self, input, outcome, learn_time):
+        if self.records is not None:
+            record = interaction_record(self.colors, self.target_index, input, self.naive_desc[self.target_index], self.context_desc[self.target_index],
+                                        outcome, {'fit_colors': self.fit_time, 'learning': learn_time}, self.step_metrics.as_dict(), self.learn_mode)
+            self.records.write(record)
+
     def log_colors(self):
         for i, c in enumerate(self.colors):
             logging.info(f"Color{i}: {c}")
         logging.info(f"Target Index: {self.target_index}")
 
-    def draw(self, draw_indication_arrow=True):
+    def draw(self, draw_indication_arrow=True, colors=None, target_index=None):
+        # draws the current scene if no other is given
+        colors = self.colors if colors is None else colors
+        target_index = self.target_index if target_index is None else target_index
+
         self.canvas.delete('all')
-        self.canvas.create_oval(50, 50, 150, 150, width=2, fill=self.colors[0].html())
-        self.canvas.create_oval(250, 50, 350, 150, width=2, fill=self.colors[1].html())
-        if len(self.colors) > 2:
-            self.canvas.create_oval(50, 250, 150, 350, width=2, fill=self.colors[2].html())
-        if len(self.colors) > 3:
-            self.canvas.create_oval(250, 250, 350, 350, width=2, fill=self.colors[3].html())
+        self.canvas.create_oval(50, 50, 150, 150, width=2, fill=colors[0].html())
+        self.canvas.create_oval(250, 50, 350, 150, width=2, fill=colors[1].html())
+        if len(colors) > 2:
+            self.canvas.create_oval(50, 250, 150, 350, width=2, fill=colors[2].html())
+        if len(colors) > 3:
+            self.canvas.create_oval(250, 250, 350, 350, width=2, fill=colors[3].html())
 
         # draw indication arrow
-        if draw_indication_arrow and len(self.colors) == 2:
-            arrowX = 100 if self.target_index == 0 else 300
+        if draw_indication_arrow and len(colors) == 2:
+            arrowX = 100 if target_index == 0 else 300
             self.canvas.create_line(arrowX, 250, arrowX, 180, width=3, arrow='last', arrowshape=(16, 20, 6))
\ No newline at end of file
@@ -0,0 +1,79 @@
+import time
+import contextlib
+import cProfile
+import pstats
+import io
+
+
+# number of functions (sorted by cumulative time) kept of a profiled step
+profile_entries = 15
+
+
+class StepMetrics:
+    """
+    Measurements of one interaction (fitting the scene and learning from the input).
+
+    timings: seconds spent per stage, e.g. fit_colors, learning, minimize and adjust (accumulated over all calls)
+    counts: e.g. evaluations of the objective and constraints and their gradients, solver iterations,
+            involved prototypes and constraints
+    profile: if activated, the measured stages are profiled with cProfile
+    """
+
+    def __init__(self, profile=False):
+        self.timings = {}
+        self.counts = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.depth = 0
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        if self.profiler is not None and self.depth == 0:
+            self.profiler.enable()
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0) + time.perf_counter() - start
+            self.depth -= 1
+            if self.profiler is not None and self.depth == 0:
+                self.profiler.disable()
+
+    def count(self, name: str, number=1):
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def profile_stats(self, entries=profile_entries):
+        # the most expensive functions as (function, calls, own time, cumulative time)
+        if self.profiler is None:
+            return None
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        stats.sort_stats('cumulative')
+        result = []
+        for function in stats.fcn_list[:entries]:
+            calls, _, own_time, cumulative_time, _ = stats.stats[function]
+            result.append({'function': pstats.func_std_string(function), 'calls': calls, 'tottime': own_time, 'cumtime': cumulative_time})
+        return result
+
+    def dump_profile(self, path):
+        # can be read with pstats or snakeviz
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+    def as_dict(self):
+        return {'timings': dict(self.timings), 'counts': dict(self.counts), 'profile': self.profile_stats()}
+
+    def __str__(self):
+        timings = ', '.join(f"{stage}: {seconds * 1000:.1f}ms" for stage, seconds in self.timings.items())
+        counts = ', '.join(f"{name}: {number}" for name, number in self.counts.items())
+        return f"{timings} | {counts}"
+
+
+def measure(metrics: StepMetrics, stage: str):
+    # measures a stage if metrics are collected
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.measure(stage)
+
+def count(metrics: StepMetrics, name: str, number=1):
+    if metrics is not None:
+        metrics.count(name, number)
@@ -1,20 +1,43 @@
 import pandas as pd
 import numpy as np
-import itertools
-from scipy.stats import circmean
-from scipy.optimize import minimize
 import logging
+import math
+import threading
+from collections import OrderedDict
 
 from colors import Color
+from scoring import ScoringEngine, color_array, hue_difference, parameter_columns
+from instrumentation import StepMetrics, count, measure
+from solvers import minimize_border_change
+from prototype_store import PrototypeStore, prototype_values
 import model 
 
 aimed_difference = 0.02
 convergence_tolerance = 0.01
 add_all_distracting_categories = False # standard, see Paper
+# solver used if none is given to the learning, 'slsqp', 'gauss-newton' or 'auto' (see solvers.py)
+default_solver = 'slsqp'
 
 accumulated_number = 15
 
-log_columns = ['hc', 'hr', 'sc', 'sr', 'lc', 'lr', 'acc0', 'acc1', 'score0', 'score1', 'change_borders']
+# number of solved learning problems kept per model, an exact repeat is answered from the cache
+solution_cache_size = 128
+# colors are rounded to multiples of this value when problems are compared
+color_quantization = 1
+# similar problems (same goals, distance of colors and parameters at most warm_start_distance) start from the cached solution
+warm_start = True
+warm_start_distance = 30
+# the evaluated point is copied and the model is taken from result.x. If deactivated, the point is kept by reference and
+# the model is taken from the last evaluation like before this was fixed, e.g. to measure the effect of the fix on replayed logs
+# (SLSQP changes the point in place, so adjust() misses some changes and the last evaluation is not always at result.x)
+copy_evaluated_x = True
+# SLSQP gets the analytic gradients of the border change and the constraints. If deactivated, SLSQP approximates them
+# by finite differences like before they were added, e.g. to regenerate the thesis logs (the gauss-newton solver always uses them)
+analytic_gradients = True
+
+def log_columns(color_number: int):
+    # columns of the logged learning frames for scenes with color_number objects
+    return parameter_columns + [f'acc{i}' for i in range(color_number)] + [f'score{i}' for i in range(color_number)] + ['change_borders']
 
 # ======================================
 # ============== Goals =================
@@ -44,48 +67,175 @@ def _generate_goal(model: pd.DataFrame, color_index: int, target_category: str,
 # =========== Statistical ==============
 # ======================================
 
-def execute_statistical_learning(model: pd.DataFrame, color_name, h, s, l, change_limit=float('inf')):
-    color = model.loc[color_name]
+def execute_statistical_learning(model, color_name, h, s, l, change_limit=float('inf'), log: logging.Logger = None):
+    log = log or logging.getLogger()
 
-    hues = np.full(accumulated_number, color['hc'])
-    hues[0] = h
-    new_hc = circmean(hues, high=360, low=0)
-    delta = (new_hc - color['hc']) % 360
-    if delta > 180:
-        delta -= 360
-    color['hc'] = new_hc
-    color['hr'] = np.sqrt(((accumulated_number - 1) * (color['hr'] ** 2 + delta ** 2) + min((h - new_hc) ** 2, (h - 360 - new_hc) ** 2, (h + 360 - new_hc) ** 2)) / accumulated_number)
-    new_sc = ((accumulated_number - 1) * color['sc'] + s) / accumulated_number
-    delta = new_sc - color['sc']
-    color['sc'] = new_sc
-    color['sr'] = np.sqrt(((accumulated_number - 1) * (color['sr'] ** 2 + delta ** 2) + (s - new_sc) ** 2) / accumulated_number)
-    new_lc = ((accumulated_number - 1) * color['lc'] + l) / accumulated_number
-    delta = new_lc - color['lc']
-    color['lc'] = new_lc
-    color['lr'] = np.sqrt(((accumulated_number - 1) * (color['lr'] ** 2 + delta ** 2) + (l - new_lc) ** 2) / accumulated_number)
-
-    change_border = calc_boder_change(model.loc[color_name], color)
+    if isinstance(model, pd.DataFrame):
+        # a DataFrame is learned through a PrototypeStore, the changed prototype is written back
+        store = PrototypeStore.from_frame(model)
+        outcome = execute_statistical_learning(store, color_name, h, s, l, change_limit, log)
+        if outcome['status'] == 'changed':
+            store.write_to(model, [color_name])
+        return outcome
+
+    old = model.get(color_name)
+    new = statistical_update_prototype(old, h, s, l)
+
+    change_border = calc_boder_change(old, new)
+    changes = {color_name: {column: new_value - old_value for column, new_value, old_value in zip(parameter_columns, new, old)}}
 
     if change_border < change_limit:
-        logging.info(f"Border Change: {change_border}")
-        model.loc[color_name] = color
+        log.info(f"Border Change: {change_border}")
+        model.set(color_name, new)
+        return learning_outcome('changed', change_border, changes)
     else:
-        logging.info(f"The change limit of {change_limit} was exceeded. Model not changed.")
+        log.info(f"The change limit of {change_limit} was exceeded. Model not changed.")
         print(f"The change limit of {change_limit} was exceeded. Model not changed.")
+        return learning_outcome('change_limit_exceeded', change_border, changes)
+
+def execute_statistical_batch(model, observations: list[tuple], change_limit=float('inf'), log: logging.Logger = None):
+    """
+    Applies observations (color_name, h, s, l) like execute_statistical_learning one after another, e.g. to bootstrap
+    a knowledge base from logs, and returns their outcomes in the same order. An observation only changes its own
+    prototype, so the i-th observations of all color names are applied at once and only the largest number of
+    observations of one color name is iterated. The results are identical to the sequential application.
+    """
+    log = log or logging.getLogger()
+
+    if isinstance(model, pd.DataFrame):
+        store = PrototypeStore.from_frame(model)
+        outcomes = execute_statistical_batch(store, observations, change_limit, log)
+        changed = list(dict.fromkeys(name for outcome in outcomes if outcome['status'] == 'changed' for name in outcome['changes']))
+        if changed:
+            store.write_to(model, changed)
+        return outcomes
+
+    names = [observation[0] for observation in observations]
+    unknown = [name for name in dict.fromkeys(names) if name not in model]
+    if unknown:
+        raise Exception(f"Error: Unknown color names {unknown}!")
+    rows = np.array([model.rows[name] for name in names], dtype=int)
+    hsl = np.array([observation[1:] for observation in observations], dtype=float).reshape(-1, 3)
+
+    # rank of every observation among the observations of the same color name
+    order = np.argsort(rows, kind='stable')
+    first = np.searchsorted(rows[order], rows[order])
+    rank = np.empty(len(rows), dtype=int)
+    rank[order] = np.arange(len(rows)) - first
+
+    old = np.empty((len(rows), 6))
+    new = np.empty((len(rows), 6))
+    border_change = np.empty(len(rows))
+    changed = np.zeros(len(rows), dtype=bool)
+
+    by_rank = np.argsort(rank, kind='stable')
+    for step in np.split(by_rank, np.searchsorted(rank[by_rank], np.arange(1, rank.max(initial=0) + 1))):
+        old[step] = model.parameters[rows[step]]
+        new[step] = statistical_update(old[step], *hsl[step].T)
+        border_change[step] = calc_border_changes(old[step], new[step])
+        changed[step] = border_change[step] < change_limit
+        model.parameters[rows[step[changed[step]]]] = new[step[changed[step]]]
+
+    log.info(f"Statistical learning of {len(rows)} observations: {changed.sum()} changed, {len(rows) - changed.sum()} exceeded the change limit of {change_limit}")
+
+    differences = (new - old).tolist()
+    return [learning_outcome('changed' if changed[i] else 'change_limit_exceeded', border_change[i], {name: dict(zip(parameter_columns, differences[i]))})
+            for i, name in enumerate(names)]
+
+def statistical_update(parameters: np.ndarray, h, s, l):
+    """
+    The prototypes (rows of hc, hr, sc, sr, lc, lr) after one observation each, h, s and l are scalars or one value per row.
+    Every prototype keeps the weight of accumulated_number - 1 observations.
+    """
+    hc, hr, sc, sr, lc, lr = np.asarray(parameters, dtype=float).reshape(-1, 6).T
+    n = accumulated_number
+
+    new_hc = circular_mean(h, hc, n - 1)
+    delta = (new_hc - hc) % 360
+    delta = np.where(delta > 180, delta - 360, delta)
+    new_hr = np.sqrt(((n - 1) * (hr ** 2 + delta ** 2) + np.minimum(np.minimum((h - new_hc) ** 2, (h - 360 - new_hc) ** 2), (h + 360 - new_hc) ** 2)) / n)
+    new_sc = ((n - 1) * sc + s) / n
+    new_sr = np.sqrt(((n - 1) * (sr ** 2 + (new_sc - sc) ** 2) + (s - new_sc) ** 2) / n)
+    new_lc = ((n - 1) * lc + l) / n
+    new_lr = np.sqrt(((n - 1) * (lr ** 2 + (new_lc - lc) ** 2) + (l - new_lc) ** 2) / n)
+
+    return np.stack([new_hc, new_hr, new_sc, new_sr, new_lc, new_lr], axis=1)
+
+def statistical_update_prototype(prototype: tuple, h, s, l):
+    # statistical_update of a single prototype (hc, hr, sc, sr, lc, lr) on floats, the same operations give the same values
+    # (squares are written as products like numpy computes x ** 2, the pow of floats can differ in the last bit)
+    hc, hr, sc, sr, lc, lr = prototype
+    n = accumulated_number
+
+    new_hc = float(circular_mean(h, hc, n - 1))
+    delta = (new_hc - hc) % 360
+    if delta > 180:
+        delta -= 360
+    d0, d1, d2 = h - new_hc, h - 360 - new_hc, h + 360 - new_hc
+    new_hr = math.sqrt(((n - 1) * (hr * hr + delta * delta) + min(d0 * d0, d1 * d1, d2 * d2)) / n)
+    new_sc = ((n - 1) * sc + s) / n
+    ds, ds_new = new_sc - sc, s - new_sc
+    new_sr = math.sqrt(((n - 1) * (sr * sr + ds * ds) + ds_new * ds_new) / n)
+    new_lc = ((n - 1) * lc + l) / n
+    dl, dl_new = new_lc - lc, l - new_lc
+    new_lr = math.sqrt(((n - 1) * (lr * lr + dl * dl) + dl_new * dl_new) / n)
+
+    return (new_hc, new_hr, new_sc, new_sr, new_lc, new_lr)
+
+def circular_mean(h, hc, weight):
+    # mean direction in degrees of h and weight times hc (circmean of the repeated hues), vectorized
+    h, hc = np.radians(h), np.radians(hc)
+    return np.degrees(np.arctan2(np.sin(h) + weight * np.sin(hc), np.cos(h) + weight * np.cos(hc))) % 360
+
+def learning_outcome(status: str, border_change: float, changes: dict, result=None):
+    # summary of a learning step, e.g. for the structured logs
+    outcome = {'status': status, 'border_change': float(border_change), 'changes': changes}
+    if result is not None:
+        outcome['solver'] = {'success': bool(result.success), 'message': str(result.message), 'nit': int(result.nit), 'nfev': int(result.nfev), 'njev': int(result.njev)}
+    return outcome
 
 def calc_boder_change(prot_old, prot_new):
-    h0_old = (prot_old['hc'] - prot_old['hr']) % 360
-    h1_old = (prot_old['hc'] + prot_old['hr']) % 360
-    h0_new = (prot_new['hc'] - prot_new['hr']) % 360
-    h1_new = (prot_new['hc'] + prot_new['hr']) % 360
-
-    border_change = 0
-    border_change += min(np.abs(h0_new - h0_old), np.abs(h0_new - 360 - h0_old), np.abs(h0_new + 360 - h0_old)) ** 2
-    border_change += min(np.abs(h1_new - h1_old), np.abs(h1_new - 360 - h1_old), np.abs(h1_new + 360 - h1_old)) ** 2
-    border_change += (max(min(prot_new['sc'] - prot_new['sr'], 100), 0) - max(min(prot_old['sc'] - prot_old['sr'], 100), 0))  ** 2
-    border_change += (max(min(prot_new['sc'] + prot_new['sr'], 100), 0) - max(min(prot_old['sc'] + prot_old['sr'], 100), 0))  ** 2
-    border_change += (max(min(prot_new['lc'] - prot_new['lr'], 100), 0) - max(min(prot_old['lc'] - prot_old['lr'], 100), 0))  ** 2
-    border_change += (max(min(prot_new['lc'] + prot_new['lr'], 100), 0) - max(min(prot_old['lc'] + prot_old['lr'], 100), 0))  ** 2
+    # prototypes as records of a PrototypeStore, rows of a DataFrame or tuples (hc, hr, sc, sr, lc, lr),
+    # the same operations as calc_border_changes on floats (see statistical_update_prototype)
+    hc_old, hr_old, sc_old, sr_old, lc_old, lr_old = prototype_values(prot_old)
+    hc_new, hr_new, sc_new, sr_new, lc_new, lr_new = prototype_values(prot_new)
+
+    h0_old = (hc_old - hr_old) % 360
+    h1_old = (hc_old + hr_old) % 360
+    h0_new = (hc_new - hr_new) % 360
+    h1_new = (hc_new + hr_new) % 360
+
+    differences = [
+        min(abs(h0_new - h0_old), abs(h0_new - 360 - h0_old), abs(h0_new + 360 - h0_old)),
+        min(abs(h1_new - h1_old), abs(h1_new - 360 - h1_old), abs(h1_new + 360 - h1_old)),
+        max(min(sc_new - sr_new, 100), 0) - max(min(sc_old - sr_old, 100), 0),
+        max(min(sc_new + sr_new, 100), 0) - max(min(sc_old + sr_old, 100), 0),
+        max(min(lc_new - lr_new, 100), 0) - max(min(lc_old - lr_old, 100), 0),
+        max(min(lc_new + lr_new, 100), 0) - max(min(lc_old + lr_old, 100), 0),
+    ]
+    border_change = 0.0
+    for difference in differences:
+        border_change += difference * difference
+
+    return border_change
+
+def calc_border_changes(parameters_old: np.ndarray, parameters_new: np.ndarray):
+    # border change of every row of the parameters (hc, hr, sc, sr, lc, lr)
+    hc_old, hr_old, sc_old, sr_old, lc_old, lr_old = np.asarray(parameters_old, dtype=float).reshape(-1, 6).T
+    hc_new, hr_new, sc_new, sr_new, lc_new, lr_new = np.asarray(parameters_new, dtype=float).reshape(-1, 6).T
+
+    h0_old = (hc_old - hr_old) % 360
+    h1_old = (hc_old + hr_old) % 360
+    h0_new = (hc_new - hr_new) % 360
+    h1_new = (hc_new + hr_new) % 360
+
+    border_change = np.zeros(len(hc_old))
+    border_change += np.minimum(np.minimum(np.abs(h0_new - h0_old), np.abs(h0_new - 360 - h0_old)), np.abs(h0_new + 360 - h0_old)) ** 2
+    border_change += np.minimum(np.minimum(np.abs(h1_new - h1_old), np.abs(h1_new - 360 - h1_old)), np.abs(h1_new + 360 - h1_old)) ** 2
+    border_change += (np.clip(sc_new - sr_new, 0, 100) - np.clip(sc_old - sr_old, 0, 100)) ** 2
+    border_change += (np.clip(sc_new + sr_new, 0, 100) - np.clip(sc_old + sr_old, 0, 100)) ** 2
+    border_change += (np.clip(lc_new - lr_new, 0, 100) - np.clip(lc_old - lr_old, 0, 100)) ** 2
+    border_change += (np.clip(lc_new + lr_new, 0, 100) - np.clip(lc_old + lr_old, 0, 100)) ** 2
 
     return border_change
 
@@ -93,105 +243,338 @@ def calc_boder_change(prot_old, prot_new):
 # =========== Minimization =============
 # ======================================
 
-def adjust(x):
-    global adjustedX
-    if np.array_equal(x, adjustedX):
-        return
-    adjustedX = x
-    
-    adjust_model['hc'] = adjust_model.apply(lambda prot: (prot['hc_real'] + x[int(prot['idx'] * 6)]) % 360, axis=1)
-    adjust_model['hr'] = adjust_model.apply(lambda prot: max(min(prot['hr_real'] + x[int(prot['idx'] * 6 + 1)], 180), 1), axis=1)
-    adjust_model['h0'] = adjust_model.apply(lambda prot: (prot['hc'] - prot['hr']) % 360, axis=1)
-    adjust_model['h1'] = adjust_model.apply(lambda prot: (prot['hc'] + prot['hr']) % 360, axis=1)
-    adjust_model['sc'] = adjust_model.apply(lambda prot: max(min(prot['sc_real'] + x[int(prot['idx'] * 6 + 2)], 100), 0), axis=1)
-    adjust_model['sr'] = adjust_model.apply(lambda prot: max(min(prot['sr_real'] + x[int(prot['idx'] * 6 + 3)], 100), 1), axis=1)
-    adjust_model['s0'] = adjust_model.apply(lambda prot: max(min(prot['sc'] - prot['sr'], 100), 0), axis=1)
-    adjust_model['s1'] = adjust_model.apply(lambda prot: max(min(prot['sc'] + prot['sr'], 100), 0), axis=1)
-    adjust_model['lc'] = adjust_model.apply(lambda prot: max(min(prot['lc_real'] + x[int(prot['idx'] * 6 + 4)], 100), 0), axis=1)
-    adjust_model['lr'] = adjust_model.apply(lambda prot: max(min(prot['lr_real'] + x[int(prot['idx'] * 6 + 5)], 100), 1), axis=1)
-    adjust_model['l0'] = adjust_model.apply(lambda prot: max(min(prot['lc'] - prot['lr'], 100), 0), axis=1)
-    adjust_model['l1'] = adjust_model.apply(lambda prot: max(min(prot['lc'] + prot['lr'], 100), 0), axis=1)
-
-    model.fit_colors(colors, used_model=adjust_model)
-
-def constraint_metric(x, color_index, target_category, distracting_category, metric: str = 'score'):
-    adjust(x)
-    return adjust_model.at[target_category, f'{metric}{color_index}'] - adjust_model.at[distracting_category, f'{metric}{color_index}'] - aimed_difference
-
-def calc_border_change(prot):
-    sum = 0
-    # add hue border change
-    for i in [0,1]:
-        sum += min(np.abs(prot[f'h{i}'] - prot[f'h{i}_real']), np.abs(prot[f'h{i}'] - 360 - prot[f'h{i}_real']), np.abs(prot[f'h{i}'] + 360 - prot[f'h{i}_real'])) ** 2
-    # add saturation and lightness border
-    for (dimension, i) in itertools.product(['s', 'l'], [0, 1]):
-        sum += (prot[f'{dimension}{i}'] - prot[f'{dimension}{i}_real']) ** 2
-    
-    return sum
+def clamp_parameters(parameters: np.ndarray):
+    hc, hr, sc, sr, lc, lr = parameters.T
+    return np.stack([hc % 360, np.clip(hr, 1, 180), np.clip(sc, 0, 100), np.clip(sr, 1, 100), np.clip(lc, 0, 100), np.clip(lr, 1, 100)], axis=1)
 
-def change(x):
-    adjust(x)
+def clamp_parameters_gradient(parameters: np.ndarray):
+    # one-sided derivative of the clamping: an offset only has an effect if the parameter can still grow
+    lower = np.array([-np.inf, 1, 0, 1, 0, 1])
+    upper = np.array([np.inf, 180, 100, 100, 100, 100])
+    return ((parameters >= lower) & (parameters < upper)).astype(float)
 
-    adjust_model['change_borders'] = adjust_model.apply(calc_border_change, axis=1)
-    return adjust_model['change_borders'].sum()
+def calc_borders(parameters: np.ndarray):
+    hc, hr, sc, sr, lc, lr = parameters.T
+    return np.stack([(hc - hr) % 360, (hc + hr) % 360, np.clip(sc - sr, 0, 100), np.clip(sc + sr, 0, 100), np.clip(lc - lr, 0, 100), np.clip(lc + lr, 0, 100)], axis=1)
 
-def execute_naive_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, change_limit=float('inf')):
-    return _execute_learning(model, colors_input, goals, metric='acc', change_limit=change_limit)
+def calc_borders_change(borders: np.ndarray, borders_real: np.ndarray):
+    diff = borders - borders_real
+    # hue borders are compared on the circle, prototypes without hue have no hue border
+    diff[:, :2] = np.nan_to_num(hue_difference(borders[:, :2], borders_real[:, :2]))
+    return (diff ** 2).sum(axis=1)
 
-def execute_context_sensitive_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, change_limit=float('inf')):
-    return _execute_learning(model, colors_input, goals, metric='score', change_limit=change_limit)
+def calc_borders_change_gradient(parameters: np.ndarray, borders: np.ndarray, borders_real: np.ndarray):
+    hc, hr, sc, sr, lc, lr = parameters.T
+    diff = borders - borders_real
+    diff[:, :2] = np.nan_to_num(hue_difference(borders[:, :2], borders_real[:, :2]))
 
-def _execute_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, metric: str, change_limit: float):
-    global colors 
-    colors = colors_input
-    
-    involved_prots = set()
-    for goal in goals:
-        involved_prots.add(goal['target_category'])
-        involved_prots.update(goal['distracting_categories'])
-    mask =  model.index.to_series().isin(involved_prots)
-
-    global adjust_model
-    adjust_model = model.loc[mask, ['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].copy()
-    adjust_model['idx'] = range(0, len(adjust_model))
-    adjust_model['hc_real'] = adjust_model['hc']
-    adjust_model['hr_real'] = adjust_model['hr']
-    adjust_model['sc_real'] = adjust_model['sc']
-    adjust_model['sr_real'] = adjust_model['sr']
-    adjust_model['lc_real'] = adjust_model['lc']
-    adjust_model['lr_real'] = adjust_model['lr']
-    adjust_model['h0_real'] = adjust_model.apply(lambda prot: (prot['hc_real'] - prot['hr_real']) % 360, axis=1)
-    adjust_model['h1_real'] = adjust_model.apply(lambda prot: (prot['hc_real'] + prot['hr_real']) % 360, axis=1)
-    adjust_model['s0_real'] = adjust_model.apply(lambda prot: max(min(prot['sc_real'] - prot['sr_real'], 100), 0), axis=1)
-    adjust_model['s1_real'] = adjust_model.apply(lambda prot: max(min(prot['sc_real'] + prot['sr_real'], 100), 0), axis=1)
-    adjust_model['l0_real'] = adjust_model.apply(lambda prot: max(min(prot['lc_real'] - prot['lr_real'], 100), 0), axis=1)
-    adjust_model['l1_real'] = adjust_model.apply(lambda prot: max(min(prot['lc_real'] + prot['lr_real'], 100), 0), axis=1)
-    adjust_model['change_borders'] = 0
-
-    x0 = np.zeros(len(involved_prots) * 6)
-    constraints = []
-    for goal in goals:
-        for distracting_category in goal['distracting_categories']:
-            function = lambda x: constraint_metric(x, goal['color_index'], goal['target_category'], distracting_category, metric)
-            constraints.append({'type': 'ineq', 'fun': function})
-
-    global adjustedX
-    adjustedX = np.ones(len(involved_prots) * 6) # just to differ from x0 for executing adjust() once 
-    adjust(x0)
-
-    print(adjust_model[log_columns])
-    logging.info(adjust_model[log_columns])
-
-    result = minimize(change, x0, constraints=constraints, tol=convergence_tolerance)
-    if result.success:
-        if adjust_model['change_borders'].sum() < change_limit:
-            print(adjust_model[log_columns])
-            logging.info(adjust_model[log_columns])
-            model.loc[mask, ['hc', 'hr', 'sc', 'sr', 'lc', 'lr']] = adjust_model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']]
+    # derivative of the clamped saturation and lightness borders
+    s0 = ((sc - sr >= 0) & (sc - sr < 100)) * diff[:, 2]
+    s1 = ((sc + sr >= 0) & (sc + sr < 100)) * diff[:, 3]
+    l0 = ((lc - lr >= 0) & (lc - lr < 100)) * diff[:, 4]
+    l1 = ((lc + lr >= 0) & (lc + lr < 100)) * diff[:, 5]
+
+    return 2 * np.stack([diff[:, 0] + diff[:, 1], diff[:, 1] - diff[:, 0], s0 + s1, s1 - s0, l0 + l1, l1 - l0], axis=1)
+
+def calc_borders_change_hessian(parameters: np.ndarray, kink_margin=0.0):
+    # Gauss-Newton matrix of calc_borders_change, 2x2 blocks of (center, radius) per prototype and dimension
+    hc, hr, sc, sr, lc, lr = parameters.T
+    # prototypes without hue have no hue border
+    h = (~np.isnan(hc)).astype(float)
+    # borders within kink_margin of a clamp count as unclamped, so the model does not flip at the kinks
+    s0, s1 = ((sc - sr >= -kink_margin) & (sc - sr < 100 + kink_margin)).astype(float), ((sc + sr >= -kink_margin) & (sc + sr < 100 + kink_margin)).astype(float)
+    l0, l1 = ((lc - lr >= -kink_margin) & (lc - lr < 100 + kink_margin)).astype(float), ((lc + lr >= -kink_margin) & (lc + lr < 100 + kink_margin)).astype(float)
+
+    hessian = np.zeros((len(parameters), 6, 6))
+    for i, (lower, upper) in enumerate([(h, h), (s0, s1), (l0, l1)]):
+        hessian[:, 2 * i, 2 * i] = hessian[:, 2 * i + 1, 2 * i + 1] = lower + upper
+        hessian[:, 2 * i, 2 * i + 1] = hessian[:, 2 * i + 1, 2 * i] = upper - lower
+    return 2 * hessian
+
+class LearningSession:
+    """
+    State of one naive or context-sensitive learning problem: the involved prototypes,
+    the colors of the scene and the workspace of the minimization.
+    Every session is independent, so several learning problems can be solved concurrently.
+    """
+
+    def __init__(self, model: pd.DataFrame, colors_input: list[Color], goals: list[dict], metric: str, alpha: float, lower_bound: float, log: logging.Logger = None,
+                 step_metrics: StepMetrics = None, solution_cache: 'SolutionCache' = None, solver: str = None):
+        self.model = model
+        self.colors = color_array(colors_input)
+        self.goals = goals
+        self.metric = metric
+        self.alpha = alpha
+        self.lower_bound = lower_bound
+        self.log = log or logging.getLogger()
+        self.step_metrics = step_metrics
+        self.solution_cache = solution_cache
+        self.solver = solver or default_solver
+
+        involved_prots = set()
+        for goal in goals:
+            involved_prots.add(goal['target_category'])
+            involved_prots.update(goal['distracting_categories'])
+        self.mask = model.index.to_series().isin(involved_prots)
+
+        self.parameters_real = model.loc[self.mask, parameter_columns].to_numpy(dtype=float)
+        self.borders_real = calc_borders(self.parameters_real)
+        self.involved_index = {name: i for i, name in enumerate(model.index[self.mask])}
+
+        self.adjustedX = None
+        self.result = None
+
+    def adjust(self, x):
+        if self.adjustedX is not None and np.array_equal(x, self.adjustedX):
+            return
+        with measure(self.step_metrics, 'adjust'):
+            self._adjust(x)
+        count(self.step_metrics, 'adjust_calls')
+
+    def _adjust(self, x):
+        self.adjustedX = np.array(x) if copy_evaluated_x else x
+
+        parameters = self.parameters_real + self.adjustedX.reshape(-1, 6)
+        self.adjusted = clamp_parameters(parameters)
+        self.adjusted_gradient = clamp_parameters_gradient(parameters)
+        self.borders = calc_borders(self.adjusted)
+        self.change_borders = calc_borders_change(self.borders, self.borders_real)
+
+        engine = ScoringEngine(self.adjusted, self.alpha, self.lower_bound)
+        acc, _, score = engine.fit(self.colors)
+        self.metrics = {'acc': acc, 'score': score}
+        acc_gradient, score_gradient = engine.fit_gradient(self.colors)
+        self.metrics_gradient = {'acc': acc_gradient, 'score': score_gradient}
+
+    def constraint_metric(self, x, color_index, target_category, distracting_category, metric: str = 'score'):
+        count(self.step_metrics, 'constraint_evaluations')
+        self.adjust(x)
+        values = self.metrics[metric][:, color_index]
+        return values[self.involved_index[target_category]] - values[self.involved_index[distracting_category]] - aimed_difference
+
+    def constraint_metric_gradient(self, x, color_index, target_category, distracting_category, metric: str = 'score'):
+        count(self.step_metrics, 'constraint_gradient_evaluations')
+        self.adjust(x)
+        target, distracting = self.involved_index[target_category], self.involved_index[distracting_category]
+        gradient = np.zeros_like(self.adjusted)
+        gradient[target] += self.metrics_gradient[metric][target, color_index]
+        gradient[distracting] -= self.metrics_gradient[metric][distracting, color_index]
+        return (gradient * self.adjusted_gradient).ravel()
+
+    def change(self, x):
+        count(self.step_metrics, 'objective_evaluations')
+        self.adjust(x)
+        return self.change_borders.sum()
+
+    def change_gradient(self, x):
+        count(self.step_metrics, 'objective_gradient_evaluations')
+        self.adjust(x)
+        return (calc_borders_change_gradient(self.adjusted, self.borders, self.borders_real) * self.adjusted_gradient).ravel()
+
+    def change_hessian(self, x):
+        self.adjust(x)
+        blocks = calc_borders_change_hessian(self.adjusted) * self.adjusted_gradient[:, :, np.newaxis] * self.adjusted_gradient[:, np.newaxis, :]
+        hessian = np.zeros((blocks.shape[0] * 6, blocks.shape[0] * 6))
+        for i, block in enumerate(blocks):
+            hessian[6 * i:6 * i + 6, 6 * i:6 * i + 6] = block
+        return hessian
+
+    def step_limit(self, x, step):
+        # step length up to the first clamp of a parameter or a saturation/lightness border that is reached,
+        # the clamps are the kinks of the objective (crossed by a small margin)
+        hc, hr, sc, sr, lc, lr = (self.parameters_real + x.reshape(-1, 6)).T
+        dhc, dhr, dsc, dsr, dlc, dlr = step.reshape(-1, 6).T
+        values = np.stack([hr, sc, sr, lc, lr, sc - sr, sc + sr, lc - lr, lc + lr])
+        directions = np.stack([dhr, dsc, dsr, dlc, dlr, dsc - dsr, dsc + dsr, dlc - dlr, dlc + dlr])
+        lower = np.array([1, 0, 1, 0, 1, 0, 0, 0, 0])[:, np.newaxis]
+        upper = np.array([180, 100, 100, 100, 100, 100, 100, 100, 100])[:, np.newaxis]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            alphas = np.concatenate([((lower - values) / directions).ravel(), ((upper - values) / directions).ravel()])
+        alphas = alphas[alphas > 1e-9]
+        return min(1.0, alphas.min(initial=np.inf) + 1e-6)
+
+    def adjusted_frame(self):
+        # only used for logging, the minimization itself works on the arrays
+        frame = pd.DataFrame(self.adjusted, index=pd.Index(self.involved_index, name='colorname'), columns=parameter_columns)
+        for metric, values in self.metrics.items():
+            for i in range(values.shape[1]):
+                frame[f'{metric}{i}'] = values[:, i]
+        frame['change_borders'] = self.change_borders
+        return frame
+
+    def constraints(self):
+        constraints = []
+        for goal in self.goals:
+            for distracting_category in goal['distracting_categories']:
+                args = (goal['color_index'], goal['target_category'], distracting_category, self.metric)
+                constraints.append({'type': 'ineq', 'fun': self.constraint_metric, 'jac': self.constraint_metric_gradient, 'args': args})
+        return constraints
+
+    def minimize(self, x0: np.ndarray, constraints: list[dict]):
+        if self.solver in ('gauss-newton', 'auto'):
+            result = minimize_border_change(self.change, x0, self.change_gradient, self.change_hessian, constraints, tol=convergence_tolerance, step_limit=self.step_limit)
+            if result.success or self.solver == 'gauss-newton':
+                return result
+        if self.solver in ('slsqp', 'auto'):
+            # scipy is imported on first use, it is not needed to start the program or to name colors
+            from scipy.optimize import minimize
+            if not analytic_gradients:
+                constraints = [{key: value for key, value in constraint.items() if key != 'jac'} for constraint in constraints]
+                return minimize(self.change, x0, constraints=constraints, tol=convergence_tolerance)
+            return minimize(self.change, x0, jac=self.change_gradient, constraints=constraints, tol=convergence_tolerance)
         else:
-            logging.info(f"The change limit of {change_limit} was exceeded. Model not changed.")
-            print(f"The change limit of {change_limit} was exceeded. Model not changed.")    
-    else:
-        logging.info("Optimization not successful. Model not changed.")
-        print("Optimization not successful. Model not changed.")
-        print(result)
\ No newline at end of file
+            raise Exception("Error: Unknown solver!")
+
+    def execute(self, change_limit=float('inf')):
+        x0 = np.zeros(len(self.involved_index) * 6)
+        self.adjust(x0)
+
+        # to_string() as the number of columns grows with the objects of the scene and pandas would elide some
+        log_frame = self.adjusted_frame()[log_columns(len(self.colors))].to_string()
+        print(log_frame)
+        self.log.info(log_frame)
+
+        constraints = self.constraints()
+        count(self.step_metrics, 'involved_prototypes', len(self.involved_index))
+        count(self.step_metrics, 'constraints', len(constraints))
+
+        cached = self.solution_cache.lookup(self) if self.solution_cache is not None else None
+        if cached is not None and cached['exact']:
+            count(self.step_metrics, 'solution_cache_hits')
+            self.result = cached['result']
+        else:
+            x_warm = self.warm_start_point(cached['x'], constraints) if cached is not None else None
+            with measure(self.step_metrics, 'minimize'):
+                if x_warm is not None:
+                    count(self.step_metrics, 'warm_starts')
+                    self.result = self.minimize(x_warm, constraints)
+                if x_warm is None or not self.result.success:
+                    self.result = self.minimize(x0, constraints)
+            count(self.step_metrics, 'iterations', self.result.nit)
+            if self.solution_cache is not None:
+                self.solution_cache.store(self, self.result)
+        if copy_evaluated_x or (cached is not None and cached['exact']):
+            self.adjust(self.result.x)
+        if self.result.success:
+            if self.change_borders.sum() < change_limit:
+                log_frame = self.adjusted_frame()[log_columns(len(self.colors))].to_string()
+                print(log_frame)
+                self.log.info(log_frame)
+                self.model.loc[self.mask, parameter_columns] = self.adjusted
+                return self.outcome('changed')
+            else:
+                self.log.info(f"The change limit of {change_limit} was exceeded. Model not changed.")
+                print(f"The change limit of {change_limit} was exceeded. Model not changed.")    
+                return self.outcome('change_limit_exceeded')
+        else:
+            self.log.info("Optimization not successful. Model not changed.")
+            print("Optimization not successful. Model not changed.")
+            print(self.result)
+            return self.outcome('not_successful')
+
+    def warm_start_point(self, candidates: list[np.ndarray], constraints: list[dict]):
+        # the feasible candidate with the smallest change, the minimization starts from zero if there is none
+        best = None
+        for x in candidates:
+            if all(constraint['fun'](x, *constraint['args']) >= 0 for constraint in constraints):
+                if best is None or self.change(x) < self.change(best):
+                    best = x
+        return best
+
+    def outcome(self, status: str):
+        changes = {name: dict(zip(parameter_columns, (self.adjusted[i] - self.parameters_real[i]).tolist())) for name, i in self.involved_index.items()}
+        return learning_outcome(status, self.change_borders.sum(), changes, self.result)
+
+
+class SolutionCache:
+    """
+    Bounded LRU cache of solved learning problems.
+    Problems with the same goals (metric, color indices, target and distracting categories), scoring parameters
+    and number of colors share a signature. They are told apart by their features: the quantized colors and the parameters of the involved prototypes.
+    lookup() returns the cached solution of an exact repeat, or with warm_start the solution of the nearest problem
+    with the same signature to start the minimization from.
+    The cache can be shared by several threads.
+    """
+
+    def __init__(self, size=solution_cache_size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.warm_starts = 0
+        self.misses = 0
+
+    def key(self, session: LearningSession):
+        goals = tuple((goal['color_index'], goal['target_category'], tuple(goal['distracting_categories'])) for goal in session.goals)
+        signature = (session.solver, session.metric, session.alpha, session.lower_bound, aimed_difference, convergence_tolerance, goals, tuple(session.involved_index), len(session.colors))
+        colors = np.round(session.colors / color_quantization) * color_quantization
+        features = np.concatenate([colors.ravel(), session.parameters_real.ravel()])
+        return signature, features
+
+    def lookup(self, session: LearningSession):
+        signature, features = self.key(session)
+        with self.lock:
+            entry = self.entries.get((signature, features.tobytes()))
+            if entry is not None:
+                self.entries.move_to_end((signature, features.tobytes()))
+                self.hits += 1
+                return {'exact': True, 'x': entry['x'], 'result': entry['result']}
+
+            nearest = None
+            if warm_start:
+                distances = [(np.linalg.norm(np.nan_to_num(entry['features'] - features)), entry) for entry in self.entries.values() if entry['signature'] == signature]
+                distances = [(distance, entry) for distance, entry in distances if distance <= warm_start_distance]
+                if distances:
+                    nearest = min(distances, key=lambda item: item[0])[1]
+
+            if nearest is None:
+                self.misses += 1
+                return None
+            self.warm_starts += 1
+            # the same offsets or the same resulting parameters as the nearest problem
+            difference = nearest['parameters'] - session.parameters_real
+            difference[:, 0] = hue_difference(nearest['parameters'][:, 0], session.parameters_real[:, 0])
+            return {'exact': False, 'x': [nearest['x'].copy(), nearest['x'] + np.nan_to_num(difference).ravel()], 'result': None}
+
+    def store(self, session: LearningSession, result):
+        if self.size <= 0:
+            return
+        signature, features = self.key(session)
+        with self.lock:
+            self.entries[(signature, features.tobytes())] = {'signature': signature, 'features': features, 'parameters': session.parameters_real, 'x': np.array(result.x), 'result': result}
+            self.entries.move_to_end((signature, features.tobytes()))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# the module level functions work on an explicit session, there is no shared state between concurrent learning steps
+def adjust(session: LearningSession, x):
+    session.adjust(x)
+
+def constraint_metric(session: LearningSession, x, color_index, target_category, distracting_category, metric: str = 'score'):
+    return session.constraint_metric(x, color_index, target_category, distracting_category, metric)
+
+def change(session: LearningSession, x):
+    return session.change(x)
+
+def execute_naive_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, change_limit=float('inf'), alpha=None, lower_bound=None, log: logging.Logger = None,
+                           step_metrics: StepMetrics = None, solution_cache: SolutionCache = None, solver: str = None):
+    return _execute_learning(model, colors_input, goals, 'acc', change_limit, alpha, lower_bound, log, step_metrics, solution_cache, solver)
+
+def execute_context_sensitive_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, change_limit=float('inf'), alpha=None, lower_bound=None, log: logging.Logger = None,
+                                       step_metrics: StepMetrics = None, solution_cache: SolutionCache = None, solver: str = None):
+    return _execute_learning(model, colors_input, goals, 'score', change_limit, alpha, lower_bound, log, step_metrics, solution_cache, solver)
+
+def _execute_learning(model: pd.DataFrame, colors_input: list[Color], goals: dict, metric: str, change_limit: float, alpha=None, lower_bound=None, log: logging.Logger = None,
+                      step_metrics: StepMetrics = None, solution_cache: SolutionCache = None, solver: str = None):
+    session = LearningSession(model, colors_input, goals, metric, *_scoring_parameters(alpha, lower_bound), log=log, step_metrics=step_metrics, solution_cache=solution_cache, solver=solver)
+    return session.execute(change_limit)
+
+def _scoring_parameters(alpha, lower_bound):
+    # fall back to the parameters of the model module
+    return (model.alpha if alpha is None else alpha), (model.lower_bound if lower_bound is None else lower_bound)
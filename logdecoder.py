@@ -1,4 +1,9 @@
 import re
+import os
+import tempfile
+import zipfile
+import numpy as np
+
 from colors import Color
 
 class Entry:
@@ -10,16 +15,99 @@ class Entry:
         self.change_borders = 0
         self.correct_pred = False
 
+cache_dir = 'colorful/logs/.cache'
+_index_memory = {}
+
 def decode_log(log_id):
+    index = load_log_index(log_id)
+
+    colors = index['colors'].tolist()
+    offsets = index['color_offsets'].tolist()
+    columns = zip(index['target_index'].tolist(), index['input'].tolist(), index['input_missing'].tolist(), index['change_borders'].tolist(), index['correct_pred'].tolist())
+
     entries = []
-    with open(f'colorful/logs/log{log_id}.log', 'r', encoding="utf-8") as file:
+    for i, (target_index, input, input_missing, change_borders, correct_pred) in enumerate(columns):
+        entry = Entry()
+        entry.colors = [Color(h, s, l) for h, s, l in colors[offsets[i]:offsets[i + 1]]]
+        entry.target_index = target_index
+        entry.input = None if input_missing else input
+        entry.change_borders = change_borders
+        entry.correct_pred = correct_pred
+        entries.append(entry)
+    
+    return entries
+
+def decode_observations(log_id):
+    # (input, h, s, l) of the target color of every entry with an input, e.g. for learning.execute_statistical_batch
+    index = load_log_index(log_id)
+    answered = ~index['input_missing']
+    targets = index['colors'][index['color_offsets'][:-1] + index['target_index']][answered]
+    return [(input, h, s, l) for input, (h, s, l) in zip(index['input'][answered].tolist(), targets.tolist())]
+
+def determine_errors(log_id):
+    return load_log_index(log_id)['errors'].tolist()
+
+def load_log_index(log_id):
+    """
+    Returns the columns of a log (colors, targets, inputs, border changes, prediction and error flags).
+    The parsed columns are cached in memory and in cache_dir, both are renewed when the size or the
+    modification time of the log changes.
+    """
+    path = f'colorful/logs/log{log_id}.log'
+    stat = os.stat(path)
+    key = np.array([stat.st_mtime_ns, stat.st_size])
+
+    if path in _index_memory and np.array_equal(_index_memory[path]['key'], key):
+        return _index_memory[path]
+
+    cache_path = f'{cache_dir}/log{log_id}.npz'
+    index = None
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached['key'], key):
+                    index = dict(cached)
+        except (zipfile.BadZipFile, EOFError, ValueError, KeyError, OSError):
+            # e.g. left truncated by a killed process, it is parsed again and replaced
+            index = None
+
+    if index is None:
+        index = parse_log(path)
+        index['key'] = key
+        os.makedirs(cache_dir, exist_ok=True)
+        # written to a temporary file and moved into place, so processes replaying the same log never read a partial cache
+        fd, temp_path = tempfile.mkstemp(prefix=f'.log{log_id}-', suffix='.npz', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, **index)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    _index_memory[path] = index
+    return index
+
+def parse_log(path):
+    # reads entries and error flags of a log in one pass
+    colors = []
+    color_offsets = [0]
+    target_index = []
+    inputs = []
+    change_borders = []
+    correct_pred = []
+    errors = []
+
+    with open(path, 'r', encoding="utf-8") as file:
         cur_entry = Entry()
         indistinguishable = False
+        failed_adaption = False
         last_change_border = 1000
+        in_frame = False
         for line in file:
             if 'Color(h:' in line:
                 values = [int(re.sub('\D', '', slice)) for slice in line.split(':')[2:]]
-                cur_entry.colors.append(Color(values[0], values[1], values[2]))
+                cur_entry.colors.append(values[:3])
             elif 'Target Index' in line:
                 cur_entry.target_index = int(line.split(':')[1])
             elif 'Input:' in line:
@@ -28,11 +116,20 @@ def decode_log(log_id):
                 indistinguishable = True
             elif 'Context Prediction Correct: True' in line:
                 cur_entry.correct_pred = True
+            elif 'Model not changed' in line:
+                failed_adaption = True
             elif '---' in line:
                 if not indistinguishable:
                     if cur_entry.change_borders == 0:
                         cur_entry.correct_pred = True
-                    entries.append(cur_entry)
+                    colors.extend(cur_entry.colors)
+                    color_offsets.append(len(colors))
+                    target_index.append(cur_entry.target_index)
+                    inputs.append(cur_entry.input)
+                    change_borders.append(cur_entry.change_borders)
+                    correct_pred.append(cur_entry.correct_pred)
+                    errors.append(failed_adaption)
+                    failed_adaption = False
                 else:
                     indistinguishable = False
                 cur_entry = Entry()
@@ -42,30 +139,23 @@ def decode_log(log_id):
             last_change_border += 1
             if 'change_borders' in line:
                 last_change_border = 0
-            elif last_change_border == 2 or last_change_border == 3:
-                cur_entry.change_borders += float(line.split(' ')[-1])
+                in_frame = True
+            elif last_change_border >= 2 and in_frame:
+                # one row per involved prototype until the end of the logged frame
+                try:
+                    cur_entry.change_borders += float(line.split(' ')[-1])
+                except ValueError:
+                    in_frame = False
             elif 'Border Change:' in line:
                 cur_entry.change_borders = float(line.split(':')[1].strip())
-    
-    return entries
-
-def determine_errors(log_id):
-    errors = []
-    with open(f'colorful/logs/log{log_id}.log', 'r', encoding="utf-8") as file:
-        failed_adaption = False
-        indistinguishable = False
-        for line in file:
-            if 'Indistinguishable' in line:
-                indistinguishable = True
-            elif 'Model not changed' in line:
-                failed_adaption = True
-            elif '---' in line:
-                if not indistinguishable:
-                    errors.append(failed_adaption)
-                    failed_adaption = False
-                else:
-                    indistinguishable = False
-            elif '===' in line:
-                break
 
-    return errors
\ No newline at end of file
+    return {
+        'colors': np.array(colors, dtype=int).reshape(-1, 3),
+        'color_offsets': np.array(color_offsets, dtype=int),
+        'target_index': np.array(target_index, dtype=int),
+        'input': np.array([input or '' for input in inputs], dtype=str),
+        'input_missing': np.array([input is None for input in inputs], dtype=bool),
+        'change_borders': np.array(change_borders, dtype=float),
+        'correct_pred': np.array(correct_pred, dtype=bool),
+        'errors': np.array(errors, dtype=bool),
+    }
@@ -1,4 +1,3 @@
-from gui import App
 import logdecoder
 
 
@@ -11,12 +10,16 @@ mode: sets the type of conversation. In both scenarios the user is presented a t
         'validate': No object is marked. The user is given a description and is asked to pick which object he or she thinks is the target.
 learn_mode: determines which learning algorithm is used in 'learn' mode. Has no effect if mode is 'validate'. Possible values are 
         'statistical', 'naive', 'context-sensitive'
+write_records: if activated, a structured record of every interaction is written to logs/log{log_id}.jsonl (see records.py)
+profile_steps: if activated, every interaction is profiled with cProfile and the most expensive functions are added to the records
 """
 
 # ---------------------- #
 log_id = 0
 mode = 'learn'
 learn_mode = 'naive'
+write_records = False
+profile_steps = False
 # ---------------------- #
 
 
@@ -26,7 +29,9 @@ if mode == 'learn':
     open_log_mode = 'w'
 
 if __name__ == '__main__':
-    app = App(log_id, open_log_mode)
+    from gui import App
+
+    app = App(log_id, open_log_mode, write_records, profile_steps)
 
     if not app.set_learn_mode(learn_mode + '!'):
         raise Exception("Invalid Learn Mode!")
@@ -1,111 +1,366 @@
 import numpy as np
 import pandas as pd
 import logging
+import math
 
 from colors import *
-from visualization import show
-from learning import execute_statistical_learning, execute_context_sensitive_learning, execute_naive_learning, generate_naive_goal, generate_context_sensitive_goal
+from scoring import ScoringEngine, best_names, best_names_array, color_array, parameter_columns
+from naming_grid import NamingGrid
+from prototype_index import PrototypeIndex
+from prototype_store import PrototypeStore, prototype_values
+from acc_cache import AccCache
+from instrumentation import StepMetrics, count, measure
+from learning import SolutionCache, execute_statistical_learning, execute_statistical_batch, execute_context_sensitive_learning, execute_naive_learning, generate_naive_goal, generate_context_sensitive_goal, learning_outcome
 
 
-model = pd.read_csv('colorful/knowledge_base/kb_colors_preset.csv', index_col='colorname')
-model['add_diversity'] = 0
-base_model = model.copy()
+knowledge_base_path = 'colorful/knowledge_base/kb_colors_preset.csv'
 
 alpha = 0.3
 lower_bound = 0.02
 
-def acc(prototype: pd.Series, color: Color):
+# number of scenes that are scored at once by name_scenes
+scene_chunk_size = 4096
+# knowledge bases with at least this many prototypes are scored through a PrototypeIndex
+prototype_index_threshold = 200
+
+def acc(prototype, color: Color):
+    # prototype as a record of a PrototypeStore or a row of a DataFrame
     h, s, l = color.hsl()
+    hc, hr, sc, sr, lc, lr = prototype_values(prototype)
 
     h_part = 0
-    if prototype.notna()['hc']:
-        h_part = min((h - prototype['hc']) ** 2, (h + 360 - prototype['hc']) ** 2, (h - 360 - prototype['hc']) ** 2) / (prototype['hr'] ** 2)
-    s_part = ((s - prototype['sc']) / prototype['sr']) ** 2
-    l_part = ((l - prototype['lc']) / prototype['lr']) ** 2
-
-    return max(np.exp(-0.5 * (h_part + s_part + l_part)), lower_bound)
-
-def dp(prototype: pd.Series, index, n_objects):
-    sum = 0
-    for i in range(n_objects):
-        sum += prototype[f'acc{i}']
-    return prototype[f'acc{index}'] / sum
-
-def fit_colors(colors: list[Color], used_model=model):
-    for i, color in enumerate(colors):
-        # add acceptability
-        used_model[f'acc{i}'] = used_model.apply(lambda x: acc(x, color), axis=1)
-    for i in range(len(colors)):
-        # add discriminatory power
-        used_model[f'dp{i}'] = used_model.apply(lambda x: dp(x, i, len(colors)), axis=1)
-        # calc score
-        used_model[f'score{i}'] = used_model.apply(lambda x: alpha * x[f'acc{i}'] + (1 - alpha) * x[f'dp{i}'], axis=1)
+    if not math.isnan(hc):
+        h_part = min((h - hc) ** 2, (h + 360 - hc) ** 2, (h - 360 - hc) ** 2) / (hr ** 2)
+    s_part = ((s - sc) / sr) ** 2
+    l_part = ((l - lc) / lr) ** 2
+
+    return max(math.exp(-0.5 * (h_part + s_part + l_part)), lower_bound)
+
+def load_model(path=knowledge_base_path):
+    model = pd.read_csv(path, index_col='colorname')
+    model['add_diversity'] = 0
+    return model
+
+
+class ColorModel:
+    """
+    A knowledge base of color prototypes together with the parameters used to score and learn it.
+    Every instance is independent, so several models can be used and learned concurrently.
+    The module level functions work on the default instance.
+    """
+
+    def __init__(self, path=knowledge_base_path, alpha=alpha, lower_bound=lower_bound, log: logging.Logger = None):
+        self.path = path
+        self._model: pd.DataFrame = None
+        self._store: PrototypeStore = None
+        self._base_model: pd.DataFrame = None
+        self.alpha = alpha
+        self.lower_bound = lower_bound
+        self.log = log or logging.getLogger()
+        self.acc_cache = AccCache()
+        self.scene = []
+        self.naming_grid: NamingGrid = None
+        self.naming_grid_options = (None, False)
+        self.prototype_index: PrototypeIndex = None
+        self.step_metrics: StepMetrics = None
+        self.solution_cache = SolutionCache()
+
+    @property
+    def model(self) -> pd.DataFrame:
+        # the knowledge base is read on first use
+        if self._model is None:
+            self._attach(load_model(self.path))
+            self._base_model = self._model.copy()
+        return self._model
+
+    @model.setter
+    def model(self, model: pd.DataFrame):
+        self._attach(model)
+        self.acc_cache.invalidate()
+
+    @property
+    def store(self) -> PrototypeStore:
+        # the parameters of the model, the parameter columns of the DataFrame are a view on them
+        model = self.model
+        if not np.may_share_memory(model['hc'].to_numpy(), self._store.parameters):
+            # e.g. a whole parameter column was replaced
+            self._attach(model)
+        return self._store
+
+    def _attach(self, model: pd.DataFrame):
+        self._store = PrototypeStore.from_frame(model)
+        frame = self._store.frame()
+        for column in model.columns.drop(parameter_columns):
+            frame[column] = model[column]
+        self._model = frame
+
+    @property
+    def base_model(self) -> pd.DataFrame:
+        if self._base_model is None:
+            self.model
+        return self._base_model
+
+    def start_step(self, profile=False):
+        # the following fit_colors and learning calls are measured in a new StepMetrics
+        self.step_metrics = StepMetrics(profile)
+        return self.step_metrics
+
+    def use_naming_grid(self, path=None, with_acc=False):
+        # precomputes the naive naming of all colors, it is kept up to date by the learning methods
+        # without a path the grid is stored per knowledge base and parameters (see naming_grid.naming_grid_path)
+        self.naming_grid_options = (path, with_acc)
+        self.naming_grid = NamingGrid.build(self.model, self.lower_bound, path, with_acc)
+
+    def acceptability(self, colors: list[Color]):
+        if self.naming_grid is not None and self.naming_grid.acc is not None:
+            return self.naming_grid.acceptability(colors)
+        return self.scoring_engine().acc(color_array(colors))
+
+    def scoring_engine(self, parameters: np.ndarray = None):
+        # the index is rebuilt when the parameters changed since it was built
+        if parameters is None:
+            parameters = self.model[parameter_columns].to_numpy(dtype=float)
+        if len(parameters) < prototype_index_threshold:
+            return ScoringEngine(parameters, self.alpha, self.lower_bound)
+
+        if self.prototype_index is None or not self.prototype_index.matches(parameters, self.lower_bound):
+            self.prototype_index = PrototypeIndex(parameters, self.lower_bound)
+        return ScoringEngine(parameters, self.alpha, self.lower_bound, self.prototype_index)
+
+    def fit_colors(self, colors: list[Color], used_model: pd.DataFrame = None):
+        with measure(self.step_metrics, 'fit_colors'):
+            if used_model is None or used_model is self.model:
+                used_model = self.model
+                self.scene = list(colors)
+                acc, dp, score = self._fit_incremental(colors)
+            else:
+                acc, dp, score = ScoringEngine.from_model(used_model, self.alpha, self.lower_bound).fit(colors)
+
+            for i in range(len(colors)):
+                # add acceptability
+                used_model[f'acc{i}'] = acc[:, i]
+            for i in range(len(colors)):
+                # add discriminatory power
+                used_model[f'dp{i}'] = dp[:, i]
+                # calc score
+                used_model[f'score{i}'] = score[:, i]
+
+    def _fit_incremental(self, colors: list[Color]):
+        hits, misses = self.acc_cache.hits, self.acc_cache.misses
+        acc, engine = self._cached_acc(colors)
+        count(self.step_metrics, 'acc_cache_hits', self.acc_cache.hits - hits)
+        count(self.step_metrics, 'acc_cache_misses', self.acc_cache.misses - misses)
+
+        dp = acc / acc.sum(axis=1)[:, np.newaxis]
+        return acc, dp, engine.score(acc, dp)
+
+    def _cached_acc(self, colors: list[Color]):
+        # Learning only changes a few prototypes, so for colors that were scored before only the prototypes
+        # whose version was bumped since then are recomputed (see AccCache).
+        parameters = self.model[parameter_columns].to_numpy(dtype=float)
+        engine = self.scoring_engine(parameters)
+
+        def compute(rows, colors):
+            if rows is None:
+                return engine.acc(colors)
+            return ScoringEngine(parameters[rows], self.alpha, self.lower_bound).acc(colors)
+
+        return self.acc_cache.acc(self.model.index, parameters, color_array(colors), self.lower_bound, compute), engine
+
+    def prefetch_colors(self, colors: list[Color]):
+        # scores colors ahead of fit_colors, e.g. the next scene while the user answers,
+        # fit_colors then only recomputes the prototypes changed in the meantime
+        self._cached_acc(colors)
+
+    def name_scenes(self, scenes: np.ndarray, return_tensors=False):
+        """
+        Names the objects of many scenes at once without changing the model.
+        scenes has the shape (scenes, objects, 3) with the HSL values of every object.
+        Returns the naive and the context-sensitive descriptions as arrays of the shape (scenes, objects)
+        and, if return_tensors is set, the acc and score tensors of the shape (scenes, prototypes, objects).
+        """
+        scenes = np.asarray(scenes, dtype=float)
+        engine = self.scoring_engine()
+
+        result = {'naive': [], 'context': []}
+        if return_tensors:
+            result.update(acc=[], score=[])
+        for start in range(0, len(scenes), scene_chunk_size):
+            acc, _, score = engine.fit(scenes[start:start + scene_chunk_size])
+            result['naive'].append(best_names_array(acc, self.model.index))
+            result['context'].append(best_names_array(score, self.model.index))
+            if return_tensors:
+                result['acc'].append(acc)
+                result['score'].append(score)
+
+        shapes = {'naive': (0, scenes.shape[1]), 'context': (0, scenes.shape[1]), 'acc': (0, len(self.model), scenes.shape[1]), 'score': (0, len(self.model), scenes.shape[1])}
+        return {key: np.concatenate(values) if values else np.empty(shapes[key]) for key, values in result.items()}
+
+    def best_descriptions_naive(self, color_number):
+        if self.naming_grid is not None and len(self.scene) >= color_number:
+            return self.naming_grid.best_names(self.scene[:color_number])
+        return best_names(self.model[[f'acc{i}' for i in range(color_number)]].to_numpy(), self.model.index)
+
+    def best_descriptions(self, color_number):
+        return best_names(self.model[[f'score{i}' for i in range(color_number)]].to_numpy(), self.model.index)
+
+    def colorname_exists(self, color_name):
+        if color_name not in self.model.index:
+            print(f"Colorname {color_name} is unknown!")
+            return False
+        return True
+
+    def indistinguishable_colors(self, target_index):
+        colorname = self.model[f'acc{target_index}'].idxmax()
+        self.model.at[colorname, 'add_diversity'] += 5 
+
+    def statistical_learning(self, color_name, colors: list[Color], target_index, change_limit=float('inf')):
+        if not self.colorname_exists(color_name):
+            return None
+
+        naive_desc = self.best_descriptions_naive(len(colors))[target_index]
+        context_desc = self.best_descriptions(len(colors))[target_index]
+        self.log.info(f"Naive Prediction Correct: {naive_desc == color_name}")
+        self.log.info(f"Context Prediction Correct: {context_desc == color_name}")
+
+        parameters_before = self.store.parameters.copy()
+        with measure(self.step_metrics, 'learning'):
+            outcome = execute_statistical_learning(self.store, color_name, colors[target_index].h, colors[target_index].s, colors[target_index].l, change_limit, log=self.log)
+        self._prototypes_changed(parameters_before, [outcome])
+        return outcome
+
+    def statistical_batch(self, observations: list[tuple], change_limit=float('inf')):
+        # statistical learning of many observations (color_name, h, s, l) at once, e.g. to bootstrap the knowledge base from logs,
+        # one outcome per observation in the same order, observations with an unknown color name have the status 'unknown_color'
+        known = [self.colorname_exists(observation[0]) for observation in observations]
+
+        parameters_before = self.store.parameters.copy()
+        with measure(self.step_metrics, 'learning'):
+            learned = execute_statistical_batch(self.store, [observation for observation, exists in zip(observations, known) if exists], change_limit, log=self.log)
+        learned = iter(learned)
+        outcomes = [next(learned) if exists else learning_outcome('unknown_color', 0, {}) for exists in known]
+        self._prototypes_changed(parameters_before, outcomes)
+        return outcomes
+
+    def naive_learning(self, colors: list[Color], color_labels: list[str], change_limit=float('inf'), solver: str = None):
+        goals = self._generate_goals(color_labels, generate_naive_goal)
+        if goals is None:
+            return None
+        if not goals:
+            return learning_outcome('no_change_needed', 0, {})
+
+        parameters_before = self.store.parameters.copy()
+        with measure(self.step_metrics, 'learning'):
+            outcome = execute_naive_learning(self.model, colors, goals, change_limit, self.alpha, self.lower_bound, self.log, self.step_metrics, self.solution_cache, solver)
+        self._prototypes_changed(parameters_before, [outcome])
+        return outcome
+
+    def context_sensitive_learning(self, colors: list[Color], color_labels: list[str], change_limit=float('inf'), solver: str = None):
+        goals = self._generate_goals(color_labels, generate_context_sensitive_goal)
+        if goals is None:
+            return None
+        if not goals:
+            return learning_outcome('no_change_needed', 0, {})
+
+        parameters_before = self.store.parameters.copy()
+        with measure(self.step_metrics, 'learning'):
+            outcome = execute_context_sensitive_learning(self.model, colors, goals, change_limit, self.alpha, self.lower_bound, self.log, self.step_metrics, self.solution_cache, solver)
+        self._prototypes_changed(parameters_before, [outcome])
+        return outcome
+
+    def _prototypes_changed(self, parameters_before: np.ndarray, outcomes: list[dict]):
+        # the acc cache and the naming grid are updated for the prototypes changed by the learning
+        changed = list(dict.fromkeys(name for outcome in outcomes if outcome is not None and outcome['status'] == 'changed' for name in outcome['changes']))
+        self.acc_cache.bump(changed)
+        if self.naming_grid is not None and changed:
+            rows = self.model.index.get_indexer(changed)
+            self.naming_grid.update(self.model, parameters_before[rows], rows)
+
+    def _generate_goals(self, color_labels: list[str], generate_goal):
+        goals = []
+        for index, label in enumerate(color_labels):
+            if label is not None:
+                if not self.colorname_exists(label):
+                    return None
+
+                goal = generate_goal(self.model, index, label)
+                if goal['distracting_categories']:
+                    goals.append(goal)
+        return goals
+
+    def save_model(self, id):
+        self.model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].to_csv(f'colorful/knowledge_base/kb_colors_learned_{id}.csv')
+        print("Model saved!")
+
+    def show_model(self):
+        from visualization import show
+        show(self.model)
+
+    def show_comparision(self):
+        from visualization import show
+        show(self.model, self.base_model)
+
+    def reload_model(self):
+        # the acc cache is invalidated by the model setter
+        self.model = load_model(self.path)
+        self.prototype_index = None
+        self.solution_cache.clear()
+        if self.naming_grid is not None:
+            self.use_naming_grid(*self.naming_grid_options)
+
+
+default_model = ColorModel()
+
+def __getattr__(name):
+    # model.model and model.base_model refer to the knowledge base of the default instance
+    if name in ('model', 'base_model'):
+        return getattr(default_model, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def start_step(profile=False):
+    return default_model.start_step(profile)
+
+def fit_colors(colors: list[Color], used_model: pd.DataFrame = None):
+    default_model.fit_colors(colors, used_model)
+
+def prefetch_colors(colors: list[Color]):
+    default_model.prefetch_colors(colors)
+
+def name_scenes(scenes: np.ndarray, return_tensors=False):
+    return default_model.name_scenes(scenes, return_tensors)
 
 def best_descriptions_naive(color_number):
-    return [model[f'acc{i}'].idxmax() for i in range(color_number)]
+    return default_model.best_descriptions_naive(color_number)
 
 def best_descriptions(color_number):
-    return [model[f'score{i}'].idxmax() for i in range(color_number)]
+    return default_model.best_descriptions(color_number)
 
 def colorname_exists(color_name):
-    if color_name not in model.index:
-        print(f"Colorname {color_name} is unknown!")
-        return False
-    return True
+    return default_model.colorname_exists(color_name)
 
 def indistinguishable_colors(target_index):
-    colorname = model[f'acc{target_index}'].idxmax()
-    model.at[colorname, 'add_diversity'] += 5 
+    default_model.indistinguishable_colors(target_index)
 
 def statistical_learning(color_name, colors: list[Color], target_index, change_limit=float('inf')):
-    if not colorname_exists(color_name):
-        return
-
-    naive_desc = best_descriptions_naive(len(colors))[target_index]
-    context_desc = best_descriptions(len(colors))[target_index]
-    logging.info(f"Naive Prediction Correct: {naive_desc == color_name}")
-    logging.info(f"Context Prediction Correct: {context_desc == color_name}")
-
-    execute_statistical_learning(model, color_name, colors[target_index].h, colors[target_index].s, colors[target_index].l, change_limit)
-
-def naive_learning(colors: list[Color], color_labels: list[str], change_limit=float('inf')):
-    goals = []
-    for index, label in enumerate(color_labels):
-        if label is not None:
-            if not colorname_exists(label):
-                return
-
-            goal = generate_naive_goal(model, index, label)
-            if goal['distracting_categories']:
-                goals.append(goal)
-    
-    if goals:
-        execute_naive_learning(model, colors, goals, change_limit)
-
-def context_sensitive_learning(colors: list[Color], color_labels: list[str], change_limit=float('inf')):
-    goals = []
-    for index, label in enumerate(color_labels):
-        if label is not None:
-            if not colorname_exists(label):
-                return
-
-            goal = generate_context_sensitive_goal(model, index, label)
-            if goal['distracting_categories']:
-                goals.append(goal)
-    
-    if goals:
-        execute_context_sensitive_learning(model, colors, goals, change_limit)
+    return default_model.statistical_learning(color_name, colors, target_index, change_limit)
+
+def statistical_batch(observations: list[tuple], change_limit=float('inf')):
+    return default_model.statistical_batch(observations, change_limit)
+
+def naive_learning(colors: list[Color], color_labels: list[str], change_limit=float('inf'), solver: str = None):
+    return default_model.naive_learning(colors, color_labels, change_limit, solver)
+
+def context_sensitive_learning(colors: list[Color], color_labels: list[str], change_limit=float('inf'), solver: str = None):
+    return default_model.context_sensitive_learning(colors, color_labels, change_limit, solver)
 
 def save_model(id):
-    model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].to_csv(f'colorful/knowledge_base/kb_colors_learned_{id}.csv')
-    print("Model saved!")
+    default_model.save_model(id)
 
 def show_model():
-    show(model)
+    default_model.show_model()
 
 def show_comparision():
-    show(model, base_model)
+    default_model.show_comparision()
 
 def reload_model():
-    global model
-    model = pd.read_csv('colorful/knowledge_base/kb_colors_preset.csv', index_col='colorname')
\ No newline at end of file
+    default_model.reload_model()
@@ -0,0 +1,253 @@
+import os
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from colors import Color
+from scoring import ScoringEngine, acceptability, color_array, hue_difference, parameter_columns
+
+
+naming_grid_dir = 'colorful/knowledge_base/.grids'
+grid_shape = (360, 101, 101)
+# number of grids kept in naming_grid_dir, the least recently used ones are removed when a new one is built
+naming_grid_number = 4
+
+
+class NamingGrid:
+    """
+    Precomputed naive color naming on a quantized HSL grid (hue, saturation, lightness).
+    For every grid point the index and the acceptability of the prototype with the highest acceptability are stored
+    and optionally the acceptabilities of all prototypes. The tables are memory-mapped .npy files in a directory,
+    so several processes can open and share the same grid. By default every knowledge base, lower bound and
+    table layout has its own directory (see naming_grid_path), only the naming_grid_number most recently used are kept.
+    Grids are opened copy-on-write, updates of the learning stay in the memory of the model and never change the
+    files another model or process uses.
+    """
+
+    def __init__(self, path, names, best, acc=None, lower_bound=0.02, best_acc=None):
+        self.path = path
+        self.names = list(names)
+        self.best = best
+        self.acc = acc
+        self.lower_bound = lower_bound
+        self.best_acc = best_acc
+        # cells to evaluate against all prototypes (parameters) before their best prototype is read, see update()
+        self.dirty: np.ndarray = None
+        self.parameters: np.ndarray = None
+
+    @classmethod
+    def build(cls, model: pd.DataFrame, lower_bound: float, path=None, with_acc=False, shape=grid_shape):
+        # without a path an existing grid of the same model is reused
+        if path is None:
+            path = naming_grid_path(model, lower_bound, with_acc, shape)
+            if os.path.exists(f'{path}/best.npy') and os.path.exists(f'{path}/best_acc.npy'):
+                # the modification time marks the grid as recently used for prune_naming_grids
+                os.utime(path)
+                return cls.open(path)
+
+        # the tables are written to a temporary directory and moved into place at the end (best.npy last),
+        # so grids opened by others keep their files and a grid is only found once it is complete
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        building = tempfile.mkdtemp(prefix='.building-', dir=os.path.dirname(path) or '.')
+        np.save(f'{building}/names.npy', np.array(model.index, dtype=str))
+        np.save(f'{building}/lower_bound.npy', np.array(lower_bound))
+        best = np.lib.format.open_memmap(f'{building}/best.npy', mode='w+', dtype=np.uint16, shape=shape)
+        best_acc = np.lib.format.open_memmap(f'{building}/best_acc.npy', mode='w+', dtype=np.float64, shape=shape)
+        acc = None
+        if with_acc:
+            acc = np.lib.format.open_memmap(f'{building}/acc.npy', mode='w+', dtype=np.float32, shape=shape + (len(model),))
+
+        grid = cls(building, model.index, best, acc, lower_bound, best_acc)
+        grid._compute(model, range(shape[0]))
+        grid.flush()
+        del grid, best, best_acc, acc
+
+        os.makedirs(path, exist_ok=True)
+        if not with_acc and os.path.exists(f'{path}/acc.npy'):
+            os.remove(f'{path}/acc.npy')
+        for name in ['names.npy', 'lower_bound.npy', 'acc.npy', 'best_acc.npy', 'best.npy']:
+            if os.path.exists(f'{building}/{name}'):
+                os.replace(f'{building}/{name}', f'{path}/{name}')
+        shutil.rmtree(building, ignore_errors=True)
+        if os.path.dirname(path) == naming_grid_dir:
+            prune_naming_grids()
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path, mode='c'):
+        # 'c' (copy-on-write) allows updates without writing to the shared files, 'r+' writes them
+        names = np.load(f'{path}/names.npy').tolist()
+        lower_bound = float(np.load(f'{path}/lower_bound.npy'))
+        best = np.load(f'{path}/best.npy', mmap_mode=mode)
+        acc = np.load(f'{path}/acc.npy', mmap_mode=mode) if os.path.exists(f'{path}/acc.npy') else None
+        best_acc = np.load(f'{path}/best_acc.npy', mmap_mode=mode) if os.path.exists(f'{path}/best_acc.npy') else None
+        return cls(path, names, best, acc, lower_bound, best_acc)
+
+    def _compute(self, model: pd.DataFrame, hues):
+        engine = ScoringEngine.from_model(model, 0, self.lower_bound)
+        saturation, lightness = np.meshgrid(np.arange(self.best.shape[1]), np.arange(self.best.shape[2]), indexing='ij')
+        for h in hues:
+            colors = np.column_stack([np.full(saturation.size, h), saturation.ravel(), lightness.ravel()])
+            acc = engine.acc(colors)
+            self.best[h] = acc.argmax(axis=0).reshape(saturation.shape)
+            if self.best_acc is not None:
+                self.best_acc[h] = acc.max(axis=0).reshape(saturation.shape)
+            if self.acc is not None:
+                self.acc[h] = acc.T.reshape(saturation.shape + (len(model),))
+
+    def update(self, model: pd.DataFrame, parameters_before: np.ndarray, rows):
+        """
+        Updates the cells in which the given prototypes (rows of the model) had or have an acceptability above
+        the lower bound. There only the changed prototypes are evaluated and compared with the stored best
+        acceptability. Cells in which the best prototype was changed to a lower acceptability can have another
+        best prototype, they are marked dirty and evaluated against all prototypes when they are looked up.
+        """
+        rows = np.asarray(rows)
+        parameters = model[parameter_columns].to_numpy(dtype=float, copy=True)
+        hues, s_box, l_box = self._reach(np.vstack([parameters_before, parameters[rows]]))
+        if self.best_acc is None:
+            # grids without best acceptabilities (built by older versions) are rebuilt per hue slice
+            self._compute(model, hues)
+            return
+        if len(hues) == 0:
+            return
+
+        # the acceptabilities of the changed prototypes are computed on the axes of the box and broadcast
+        saturations = np.arange(self.best.shape[1])[s_box]
+        lightnesses = np.arange(self.best.shape[2])[l_box]
+        acc = acceptability(parameters[rows][:, :, np.newaxis, np.newaxis, np.newaxis], hues[:, np.newaxis, np.newaxis],
+                            saturations[np.newaxis, :, np.newaxis], lightnesses[np.newaxis, np.newaxis, :], self.lower_bound)
+        shape = acc.shape[1:]
+        acc = acc.reshape(len(rows), -1)
+        best = self.best[hues, s_box, l_box].ravel().astype(int)
+        best_acc = self.best_acc[hues, s_box, l_box].ravel()
+
+        # the unchanged prototypes have at most best_acc, ties go to the first prototype like argmax
+        new_best = best.copy()
+        new_acc = best_acc.copy()
+        for row, values in zip(rows, acc):
+            better = (values > new_acc) | ((values == new_acc) & (row < new_best))
+            new_best = np.where(better, row, new_best)
+            new_acc = np.where(better, values, new_acc)
+
+        self.best[hues, s_box, l_box] = new_best.reshape(shape)
+        self.best_acc[hues, s_box, l_box] = new_acc.reshape(shape)
+
+        # if the best prototype lost acceptability and no changed prototype exceeds its old value, an unchanged one can be the best
+        lost = np.zeros(len(best), dtype=bool)
+        for row, values in zip(rows, acc):
+            lost |= (best == row) & (values < best_acc)
+        lost &= acc.max(axis=0) <= best_acc
+        if self.dirty is None:
+            self.dirty = np.zeros(self.best.shape, dtype=bool)
+        self.dirty[hues, s_box, l_box] |= lost.reshape(shape)
+        self.parameters = parameters
+        if self.acc is not None:
+            for row, values in zip(rows, acc):
+                self.acc[hues, s_box, l_box, row] = values.reshape(shape)
+
+    def _best_of_all(self, parameters: np.ndarray, h, s, l):
+        # the first prototype with the highest acceptability and its acceptability for the cells (h, s, l),
+        # prototypes not reaching the cells have the lower bound, the first of them is the best if no prototype reaches a cell
+        best = np.zeros(len(h), dtype=int)
+        best_acc = np.full(len(h), self.lower_bound)
+        axes = [np.arange(size, dtype=float) for size in self.best.shape]
+        reached = self._reaching(parameters, np.unique(h), (s.min(), s.max()), (l.min(), l.max()))
+        for row in np.flatnonzero(reached):
+            hc, hr, sc, sr, lc, lr = parameters[row]
+            # the terms of scoring.acceptability, computed once per axis
+            h_part = np.nan_to_num((hue_difference(axes[0], hc) / hr) ** 2)
+            s_part = ((axes[1] - sc) / sr) ** 2
+            l_part = ((axes[2] - lc) / lr) ** 2
+            acc = np.maximum(np.exp(-0.5 * (h_part[h] + s_part[s] + l_part[l])), self.lower_bound)
+            better = acc > best_acc
+            best[better] = row
+            best_acc[better] = acc[better]
+        return best, best_acc
+
+    def _reaching(self, parameters: np.ndarray, hues, s_range, l_range):
+        # prototypes with an acceptability above the lower bound somewhere in the given hues and saturation/lightness ranges
+        reach = self._reach_factor()
+        hc, hr, sc, sr, lc, lr = parameters.T
+        reached = np.isnan(hc) | (np.abs(hue_difference(hues[:, np.newaxis], hc)) <= hr * reach + 1).any(axis=0)
+        reached &= (sc - sr * reach - 1 <= s_range[1]) & (sc + sr * reach + 1 >= s_range[0])
+        reached &= (lc - lr * reach - 1 <= l_range[1]) & (lc + lr * reach + 1 >= l_range[0])
+        return reached
+
+    def _reach_factor(self):
+        # acceptabilities are above the lower bound within this many radii of the center
+        return np.sqrt(-2 * np.log(self.lower_bound)) if self.lower_bound > 0 else np.inf
+
+    def _reach(self, parameters: np.ndarray):
+        # hues and saturation/lightness slices of the cells in which the prototypes have an acceptability above the lower bound
+        reach = self._reach_factor()
+        hues = np.arange(self.best.shape[0])
+        affected = np.zeros(len(hues), dtype=bool)
+        for hc, hr in parameters[:, :2]:
+            if np.isnan(hc):
+                affected[:] = True
+                break
+            affected |= np.abs(hue_difference(hues, hc)) <= hr * reach + 1
+
+        boxes = []
+        for column, size in ((2, self.best.shape[1]), (4, self.best.shape[2])):
+            low = np.floor(np.min(parameters[:, column] - parameters[:, column + 1] * reach)) - 1
+            high = np.ceil(np.max(parameters[:, column] + parameters[:, column + 1] * reach)) + 2
+            boxes.append(slice(int(np.clip(low, 0, size)), int(np.clip(high, 0, size))))
+        return hues[affected], *boxes
+
+    def _resolve(self, h, s, l):
+        # evaluates the dirty cells among the given ones against all prototypes
+        if self.dirty is None:
+            return
+        dirty = self.dirty[h, s, l]
+        if dirty.any():
+            h, s, l = h[dirty], s[dirty], l[dirty]
+            self.best[h, s, l], self.best_acc[h, s, l] = self._best_of_all(self.parameters, h, s, l)
+            self.dirty[h, s, l] = False
+
+    def flush(self):
+        # only grids opened with mode 'r+' or being built write to their files
+        if self.dirty is not None:
+            self._resolve(*np.nonzero(self.dirty))
+        for table in (self.best, self.best_acc, self.acc):
+            if isinstance(table, np.memmap) and table.mode in ('r+', 'w+'):
+                table.flush()
+
+    def _indices(self, colors: list[Color] | np.ndarray):
+        if not isinstance(colors, np.ndarray):
+            colors = color_array(colors)
+        colors = np.rint(colors).astype(int)
+        h = colors[:, 0] % self.best.shape[0]
+        s = np.clip(colors[:, 1], 0, self.best.shape[1] - 1)
+        l = np.clip(colors[:, 2], 0, self.best.shape[2] - 1)
+        return h, s, l
+
+    def best_names(self, colors: list[Color] | np.ndarray):
+        indices = self._indices(colors)
+        self._resolve(*indices)
+        return [self.names[i] for i in self.best[indices]]
+
+    def acceptability(self, colors: list[Color] | np.ndarray):
+        # shape (prototypes, colors) like ScoringEngine.acc
+        if self.acc is None:
+            raise Exception("Error: The naming grid was built without acceptabilities!")
+        return self.acc[self._indices(colors)].T.astype(float)
+
+
+def naming_grid_path(model: pd.DataFrame, lower_bound: float, with_acc=False, shape=grid_shape):
+    # a directory per knowledge base (names and parameters), lower bound and table layout
+    key = hashlib.sha1()
+    key.update(np.array(model.index, dtype=str).tobytes())
+    key.update(model[parameter_columns].to_numpy(dtype=float).tobytes())
+    key.update(np.array([lower_bound, with_acc, *shape], dtype=float).tobytes())
+    return f'{naming_grid_dir}/{key.hexdigest()[:16]}'
+
+def prune_naming_grids(keep=naming_grid_number):
+    # removes all but the keep most recently used grids of naming_grid_dir, grids opened by others keep their memory maps
+    paths = [entry.path for entry in os.scandir(naming_grid_dir) if entry.is_dir() and not entry.name.startswith('.building-')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
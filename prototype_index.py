@@ -0,0 +1,75 @@
+import numpy as np
+
+from scoring import acceptability
+
+
+# width of the hue buckets in degrees, 360 is divided into equal buckets
+bucket_width = 5
+
+
+class PrototypeIndex:
+    """
+    Hue buckets over the prototypes of a model for large knowledge bases.
+    A prototype can only have an acceptability above the lower bound for colors within reach * radius of its center
+    in every dimension, where reach = sqrt(-2 ln lower_bound). Every bucket lists the prototypes whose hue interval
+    (on the circle) overlaps it, prototypes without hue are listed in all buckets. acc() evaluates only these
+    candidates (further filtered by saturation and lightness) and fills the rest with the lower bound,
+    the results are identical to the full evaluation of ScoringEngine.
+    """
+
+    def __init__(self, parameters: np.ndarray, lower_bound: float, bucket_width=bucket_width):
+        self.parameters = np.array(parameters, dtype=float).reshape(-1, 6)
+        self.lower_bound = lower_bound
+        self.bucket_number = max(int(round(360 / bucket_width)), 1)
+        self.bucket_width = 360 / self.bucket_number
+        self.reach = np.sqrt(-2 * np.log(lower_bound)) if lower_bound > 0 else np.inf
+
+        hc, hr, sc, sr, lc, lr = self.parameters.T
+        self.s_low, self.s_high = sc - self.reach * sr, sc + self.reach * sr
+        self.l_low, self.l_high = lc - self.reach * lr, lc + self.reach * lr
+
+        # first and last bucket of every prototype with one bucket of margin against rounding at the borders
+        h_reach = self.reach * hr
+        first = np.floor((hc - h_reach) / self.bucket_width) - 1
+        last = np.floor((hc + h_reach) / self.bucket_width) + 1
+        everywhere = np.isnan(hc) | np.isnan(hr) | (last - first + 1 >= self.bucket_number)
+        first = np.where(everywhere, 0, first).astype(int)
+        counts = np.where(everywhere, self.bucket_number, last - first + 1).astype(int)
+
+        prototypes = np.repeat(np.arange(len(self.parameters)), counts)
+        buckets = (np.repeat(first, counts) + self._ranges(counts)) % self.bucket_number
+        order = np.argsort(buckets, kind='stable')
+        self.members = prototypes[order]
+        self.starts = np.searchsorted(buckets[order], np.arange(self.bucket_number + 1))
+
+    def matches(self, parameters: np.ndarray, lower_bound: float):
+        return lower_bound == self.lower_bound and np.array_equal(self.parameters, parameters, equal_nan=True)
+
+    @staticmethod
+    def _ranges(counts: np.ndarray):
+        # 0, 1, ..., count - 1 for every count, concatenated
+        return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    def candidates(self, colors: np.ndarray):
+        # pairs of color and prototype indices whose acceptability can exceed the lower bound, colors of the shape (colors, 3)
+        buckets = np.floor(colors[:, 0] % 360 / self.bucket_width).astype(int) % self.bucket_number
+        counts = self.starts[buckets + 1] - self.starts[buckets]
+        color_index = np.repeat(np.arange(len(colors)), counts)
+        prototype_index = self.members[np.repeat(self.starts[buckets], counts) + self._ranges(counts)]
+
+        s, l = colors[color_index, 1], colors[color_index, 2]
+        near = (s >= self.s_low[prototype_index]) & (s <= self.s_high[prototype_index]) & (l >= self.l_low[prototype_index]) & (l <= self.l_high[prototype_index])
+        return color_index[near], prototype_index[near]
+
+    def acc(self, colors: np.ndarray):
+        # like ScoringEngine.acc: colors of the shape (..., colors, 3) result in (..., prototypes, colors)
+        flat = colors.reshape(-1, 3)
+        color_index, prototype_index = self.candidates(flat)
+
+        acc = np.full((len(self.parameters), len(flat)), self.lower_bound, dtype=float)
+        h, s, l = flat[color_index].T
+        acc[prototype_index, color_index] = acceptability(self.parameters[prototype_index], h, s, l, self.lower_bound)
+
+        # (prototypes, scenes * colors) to (scenes, prototypes, colors)
+        scene_shape = colors.shape[:-2]
+        return np.moveaxis(acc.reshape((len(self.parameters),) + scene_shape + colors.shape[-2:-1]), 0, -2)
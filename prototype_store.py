@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from scoring import parameter_columns
+
+
+prototype_dtype = np.dtype([(column, np.float64) for column in parameter_columns])
+
+
+class PrototypeStore:
+    """
+    The parameters of the prototypes of a knowledge base as a NumPy structured array (one record per prototype)
+    with an index from the color names to the rows. Single prototypes are read and written without pandas,
+    parameters is a (prototypes, 6) view on the same memory and frame() a DataFrame view for CSV I/O and display.
+    """
+
+    def __init__(self, names, parameters: np.ndarray):
+        self.names = list(names)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.parameters = np.ascontiguousarray(parameters, dtype=float).reshape(-1, 6)
+        self.records = self.parameters.view(prototype_dtype).reshape(-1)
+
+    @classmethod
+    def from_frame(cls, model: pd.DataFrame):
+        return cls(model.index, model[parameter_columns].to_numpy(dtype=float))
+
+    @classmethod
+    def read_csv(cls, path):
+        return cls.from_frame(pd.read_csv(path, index_col='colorname'))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def record(self, name):
+        # field access by name like a row of the DataFrame, e.g. store.record('rot')['hc']
+        return self.records[self.rows[name]]
+
+    def get(self, name):
+        # the parameters (hc, hr, sc, sr, lc, lr) as floats
+        return self.records[self.rows[name]].item()
+
+    def set(self, name, parameters):
+        self.records[self.rows[name]] = tuple(parameters)
+
+    def frame(self):
+        # shares the memory of the store, changes of the store are visible in the DataFrame
+        return pd.DataFrame(self.parameters, index=pd.Index(self.names, name='colorname'), columns=parameter_columns, copy=False)
+
+    def write_to(self, model: pd.DataFrame, names: list):
+        # copies the parameters of the given prototypes into a DataFrame with the same names
+        for column in parameter_columns:
+            if model[column].dtype != np.float64:
+                model[column] = model[column].astype(float)
+        model.loc[names, parameter_columns] = self.parameters[[self.rows[name] for name in names]]
+
+    def to_csv(self, path):
+        self.frame().to_csv(path)
+
+    def copy(self):
+        return PrototypeStore(self.names, self.parameters.copy())
+
+
+def prototype_values(prototype):
+    # (hc, hr, sc, sr, lc, lr) as floats of a record of a PrototypeStore, a row of a DataFrame or a tuple
+    if isinstance(prototype, tuple):
+        return prototype
+    if isinstance(prototype, np.void):
+        return prototype.item()
+    return tuple(float(prototype[column]) for column in parameter_columns)
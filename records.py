@@ -0,0 +1,77 @@
+"""
+Structured log of the interactions, written next to the text log as logs/log{id}.jsonl.
+Every line is one JSON record of an interaction:
+
+colors: the colors of the scene as [h, s, l]
+target_index: the index of the target color
+input: the description given by the user
+predictions: the best naive and context-sensitive description of the target before learning
+outcome: the learning outcome (status, border change, changes per prototype and the state of the solver)
+timings: the time spent per stage in seconds
+metrics: the measurements of the step (see instrumentation.StepMetrics), with the most expensive functions if it was profiled
+learn_mode: the learning algorithm of the interaction ('statistical', 'naive' or 'context-sensitive')
+"""
+
+import json
+
+from colors import Color
+from logdecoder import Entry
+
+
+def record_path(log_id):
+    return f'colorful/logs/log{log_id}.jsonl'
+
+
+class RecordWriter:
+    def __init__(self, log_id, open_mode='w'):
+        self.file = open(record_path(log_id), open_mode, encoding='utf-8')
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def interaction_record(colors: list[Color], target_index, input, naive_prediction=None, context_prediction=None, outcome=None, timings=None, metrics=None, learn_mode=None):
+    return {
+        'colors': [list(color.hsl()) for color in colors],
+        'target_index': target_index,
+        'input': input,
+        'predictions': {'naive': naive_prediction, 'context': context_prediction},
+        'outcome': outcome,
+        'timings': timings or {},
+        'metrics': metrics,
+        'learn_mode': learn_mode,
+    }
+
+
+def iter_records(log_id):
+    # yields the records one by one, without loading the whole file
+    with open(record_path(log_id), 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def decode_records(log_id, learn_mode=None):
+    """
+    Yields entries like logdecoder.decode_log, indistinguishable scenes are skipped.
+    correct_pred has the meaning of the text log: the text log only contains the context prediction in the
+    statistical mode, so the prediction counts as correct if the model was not changed or, in the statistical mode,
+    if the context prediction equals the input. learn_mode is used for records written without their learn mode.
+    """
+    for record in iter_records(log_id):
+        outcome = record['outcome'] or {}
+        if outcome.get('status') == 'indistinguishable':
+            continue
+
+        entry = Entry()
+        entry.colors = [Color(*hsl) for hsl in record['colors']]
+        entry.target_index = record['target_index']
+        entry.input = record['input']
+        if outcome.get('status') == 'changed':
+            entry.change_borders = outcome['border_change']
+        statistical = (record.get('learn_mode') or learn_mode) == 'statistical'
+        entry.correct_pred = (statistical and record['predictions']['context'] == record['input']) or entry.change_borders == 0
+        yield entry
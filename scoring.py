@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from colors import Color
+
+
+parameter_columns = ['hc', 'hr', 'sc', 'sr', 'lc', 'lr']
+
+
+def color_array(colors: list[Color]):
+    return np.array([color.hsl() for color in colors], dtype=float).reshape(-1, 3)
+
+def hue_difference(h, hc):
+    # signed hue difference with the smallest absolute value of the three candidates
+    # h - hc, h + 360 - hc and h - 360 - hc (like model.acc)
+    diff = h - hc
+    diff = np.where(np.abs(diff + 360) < np.abs(diff), diff + 360, diff)
+    diff = np.where(np.abs(diff - 360) < np.abs(diff), diff - 360, diff)
+    return diff
+
+def acceptability(parameters: np.ndarray, h, s, l, lower_bound: float):
+    # acceptability for prototype parameters of the shape (prototypes, 6, ...) broadcast against the colors
+    hc, hr, sc, sr, lc, lr = (parameters[:, i] for i in range(6))
+
+    # prototypes without hue (achromatic colors) ignore the hue dimension
+    h_part = np.nan_to_num((hue_difference(h, hc) / hr) ** 2)
+    s_part = ((s - sc) / sr) ** 2
+    l_part = ((l - lc) / lr) ** 2
+
+    return np.maximum(np.exp(-0.5 * (h_part + s_part + l_part)), lower_bound)
+
+
+class ScoringEngine:
+    """
+    Holds the prototype parameters of a model as contiguous arrays and computes the
+    acceptability, discriminatory power and score of all prototypes for all colors of a scene at once.
+    All results are matrices of the shape (prototypes, colors).
+    """
+
+    def __init__(self, parameters: np.ndarray, alpha: float, lower_bound: float, index=None):
+        self.parameters = np.ascontiguousarray(parameters, dtype=float).reshape(-1, 6)
+        self.alpha = alpha
+        self.lower_bound = lower_bound
+        # optional PrototypeIndex of the same parameters, only prototypes near a color are evaluated
+        self.index = index
+
+    @classmethod
+    def from_model(cls, model: pd.DataFrame, alpha: float, lower_bound: float):
+        return cls(model[parameter_columns].to_numpy(dtype=float), alpha, lower_bound)
+
+    def acc(self, colors: np.ndarray):
+        # colors of the shape (..., colors, 3) result in (..., prototypes, colors), e.g. for several scenes at once
+        if self.index is not None:
+            return self.index.acc(colors)
+        h, s, l = (colors[..., np.newaxis, :, i] for i in range(3))
+        return acceptability(self.parameters[:, :, np.newaxis], h, s, l, self.lower_bound)
+
+    def dp(self, acc: np.ndarray):
+        return acc / acc.sum(axis=-1, keepdims=True)
+
+    def score(self, acc: np.ndarray, dp: np.ndarray):
+        return self.alpha * acc + (1 - self.alpha) * dp
+
+    def fit(self, colors: list[Color] | np.ndarray):
+        if not isinstance(colors, np.ndarray):
+            colors = color_array(colors)
+        acc = self.acc(colors.astype(float))
+        dp = self.dp(acc)
+        return acc, dp, self.score(acc, dp)
+
+    # ============== Gradients =================
+    # derivatives with respect to the six prototype parameters, shape (prototypes, colors, 6)
+
+    def acc_gradient(self, colors: np.ndarray):
+        hc, hr, sc, sr, lc, lr = (self.parameters[:, [i]] for i in range(6))
+        h, s, l = colors[:, 0], colors[:, 1], colors[:, 2]
+
+        h_diff = np.nan_to_num(hue_difference(h, hc))
+        hr = np.nan_to_num(hr, nan=1)
+        exponential = np.exp(-0.5 * ((h_diff / hr) ** 2 + ((s - sc) / sr) ** 2 + ((l - lc) / lr) ** 2))
+        # acceptability is constant where it is clamped to the lower bound
+        exponential = np.where(exponential > self.lower_bound, exponential, 0)
+
+        return exponential[..., np.newaxis] * np.stack([
+            h_diff / hr ** 2,
+            h_diff ** 2 / hr ** 3,
+            (s - sc) / sr ** 2,
+            (s - sc) ** 2 / sr ** 3,
+            (l - lc) / lr ** 2,
+            (l - lc) ** 2 / lr ** 3,
+        ], axis=-1)
+
+    def dp_gradient(self, acc: np.ndarray, acc_gradient: np.ndarray):
+        acc_sum = acc.sum(axis=1, keepdims=True)[..., np.newaxis]
+        acc_sum_gradient = acc_gradient.sum(axis=1, keepdims=True)
+        return (acc_gradient * acc_sum - acc[..., np.newaxis] * acc_sum_gradient) / acc_sum ** 2
+
+    def fit_gradient(self, colors: list[Color] | np.ndarray):
+        if not isinstance(colors, np.ndarray):
+            colors = color_array(colors)
+        acc = self.acc(colors)
+        acc_gradient = self.acc_gradient(colors)
+        return acc_gradient, self.score(acc_gradient, self.dp_gradient(acc, acc_gradient))
+
+
+def best_names(values: np.ndarray, names):
+    # name of the prototype with the highest value for every color (first one on ties, like idxmax)
+    return [names[i] for i in values.argmax(axis=0)]
+
+def best_names_array(values: np.ndarray, names):
+    # like best_names for values of the shape (..., prototypes, colors), results in (..., colors)
+    return np.asarray(names, dtype=object)[values.argmax(axis=-2)]
@@ -1,11 +1,16 @@
 import logging
-import tkinter as tk
-from tkinter import ttk
+import os
 import random
+import time
+import itertools
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor
 
 import model
 import logdecoder
 import visualization
+from records import RecordWriter, interaction_record
 
 
 """
@@ -21,10 +26,27 @@ double: if activated, the same inputs are presented twice to the algorithm to ch
 shuffle: if activated, the scenarios (target + distractor color) stored in the log are shuffled
         and are applied in random order to the learning algorithm
 show_steps: if activated, the change in the model and the two input colors are shown after each input
+render_steps: if activated, the steps are rendered without a display into numbered frames in frames/log{id}/
+        together with an animation frames/log{id}.gif (see visualization.FrameRenderer)
 show_model: if actived, the model is shown at the end compared to the base model from the beginning
 change_limit: is the highest allowed change per step. 
         If it is exceeded, the description is considered as an outlier and the model is not adjusted.
         Can be disabled by entering: float('inf')
+write_records: if activated, a structured record of every interaction is written to logs/log{id}.jsonl (see records.py)
+text_log: if deactivated, the human-readable text log is not written
+solver: the solver of the naive and context-sensitive learning ('slsqp', 'gauss-newton' or 'auto', see solvers.py), None uses learning.default_solver
+profile_steps: if activated, every step is profiled with cProfile. The most expensive functions are added to the records
+        and the full profiles are written to logs/profiles/log{id}_{step}.prof
+The timings and counts of every step (see instrumentation.StepMetrics) are printed and added to the records.
+
+simulate_batch() replays a whole collection of logs headless on a process pool, e.g. the context-sensitive
+collection 30xxa, 30xxb, 30xxc with shuffled scenarios:
+        simulate_batch(range(1, 13), ['context-sensitive'], shuffles=[True], seeds={'a': 1, 'b': 2, 'c': 3})
+Every combination of the given values is simulated, the keys of seeds are used as name_appendix.
+
+bootstrap_model() learns all answers of the given logs statistically at once (see learning.execute_statistical_batch),
+e.g. to create a knowledge base from all user logs:
+        bootstrap_model(range(1, 13), save_id='bootstrap')
 """
 
 
@@ -35,66 +57,55 @@ name_appendix = '_appendix'
 double = False
 shuffle = False
 show_steps = True
+render_steps = False
 show_model = False
 change_limit = 750
+write_records = False
+text_log = True
+profile_steps = False
+solver = None
 # ---------------------- #
 
 
+def simulate(origin_id=origin_id, learn_mode=learn_mode, name_appendix=name_appendix, double=double, shuffle=shuffle,
+             show_steps=show_steps, show_model=show_model, change_limit=change_limit, seed=None, lower_bound=model.lower_bound,
+             write_records=write_records, text_log=text_log, render_steps=render_steps, profile_steps=profile_steps, solver=solver):
+    log_id = simulation_log_id(origin_id, learn_mode, name_appendix)
+    log_file = f'colorful/logs/log{log_id}.log'
 
-class DemoGui(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("Colorful")
-
-        self.canvas_size = 400
-        self.canvas = tk.Canvas(self, width=self.canvas_size, height=self.canvas_size)
-        self.canvas.pack(expand=tk.YES, fill=tk.BOTH)
-
-        self.description = tk.StringVar()
-        label = ttk.Label(self, textvariable=self.description, wraplength=self.canvas_size)
-        label.pack(padx=10, fill='x', expand=True)
-
-    def draw(self, colors, target_index, input):
-        self.description.set(input)
-
-        self.canvas.delete('all')
-        self.canvas.create_oval(50, 50, 150, 150, width=2, fill=colors[0].html())
-        self.canvas.create_oval(250, 50, 350, 150, width=2, fill=colors[1].html())
-
-        # draw indication arrow
-        arrowX = 100 if target_index == 0 else 300
-        self.canvas.create_line(arrowX, 250, arrowX, 180, width=3, arrow='last', arrowshape=(16, 20, 6))
-
-
-def simulate():
-    if learn_mode == 'statistical':
-        log_id = origin_id + 1000
-    elif learn_mode == 'naive':
-        log_id = origin_id + 2000
-    elif learn_mode == 'context-sensitive':
-        log_id = origin_id + 3000
+    if text_log:
+        fileh = logging.FileHandler(log_file, 'w', encoding='utf-8')
     else:
-        raise Exception("Error: Invalid Learning Mode!")
-
-    fileh = logging.FileHandler(f'colorful/logs/log{log_id}{name_appendix}.log', 'w', encoding='utf-8')
+        fileh = logging.NullHandler()
     formatter = logging.Formatter('%(message)s')
     fileh.setFormatter(formatter)
 
-    log = logging.getLogger()  # root logger
+    # every simulation logs into its own logger, so several simulations can run side by side
+    log = logging.getLogger(log_file)
     for hdlr in log.handlers[:]:  # remove all old handlers
         log.removeHandler(hdlr)
     log.addHandler(fileh)
     log.setLevel(logging.INFO)
+    log.propagate = False
+
+    color_model = model.ColorModel(lower_bound=lower_bound, log=log)
 
-    logging.info(f"<< Learn Mode: {learn_mode} >>")
-    logging.info(f"<< Change Limit set to {change_limit} >>")
+    log.info(f"<< Learn Mode: {learn_mode} >>")
+    log.info(f"<< Change Limit set to {change_limit} >>")
+
+    if write_records:
+        records = RecordWriter(log_id)
 
     if show_steps:
+        # Tk is only loaded when the steps are shown
+        from demo_gui import DemoGui
         gui = DemoGui()
+    if render_steps:
+        renderer = visualization.FrameRenderer(f'colorful/frames/log{log_id}')
 
     entries = logdecoder.decode_log(origin_id)[:60]
     if shuffle:
-        random.shuffle(entries)
+        random.Random(seed).shuffle(entries)
     if double:
         entries += entries
 
@@ -103,41 +114,112 @@ def simulate():
 
         colors = entry.colors
         target_index = entry.target_index
-        model.fit_colors(colors, used_model=model.model)
+        step_metrics = color_model.start_step(profile_steps)
+        color_model.fit_colors(colors)
+        fit_time = step_metrics.timings['fit_colors']
 
         for i, c in enumerate(colors):
-            logging.info(f"Color{i}: {c}")
-        logging.info(f"Target Index: {target_index}")
+            log.info(f"Color{i}: {c}")
+        log.info(f"Target Index: {target_index}")
         print(f"Target Index: {target_index}")
 
         input = entry.input
-        logging.info(f"Input: {input}")
+        log.info(f"Input: {input}")
         print(f"Input: {input}")
 
-        if show_steps:
-            model_before = model.model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].copy()
+        if show_steps or render_steps:
+            model_before = color_model.model[['hc', 'hr', 'sc', 'sr', 'lc', 'lr']].copy()
+
+        if write_records:
+            naive_prediction = color_model.best_descriptions_naive(len(colors))[target_index]
+            context_prediction = color_model.best_descriptions(len(colors))[target_index]
         
+        start = time.perf_counter()
+        outcome = None
         if learn_mode == 'statistical':
-            model.statistical_learning(input, colors, target_index, change_limit=change_limit)
+            outcome = color_model.statistical_learning(input, colors, target_index, change_limit=change_limit)
         elif learn_mode == 'naive':
-            color_labels = [None] * 2
+            color_labels = [None] * len(colors)
             color_labels[target_index] = input
-            model.naive_learning(colors, color_labels=color_labels, change_limit=change_limit)
+            outcome = color_model.naive_learning(colors, color_labels=color_labels, change_limit=change_limit, solver=solver)
         elif learn_mode == 'context-sensitive':
-            color_labels = [None] * 2
+            color_labels = [None] * len(colors)
             color_labels[target_index] = input
-            model.context_sensitive_learning(colors, color_labels=color_labels, change_limit=change_limit)
+            outcome = color_model.context_sensitive_learning(colors, color_labels=color_labels, change_limit=change_limit, solver=solver)
         else:
             print('Unknown learn mode! No learning executed!')
+        learn_time = time.perf_counter() - start
         
-        logging.info("---")
+        log.info("---")
+        print(f"Metrics: {step_metrics}")
+
+        if profile_steps:
+            os.makedirs('colorful/logs/profiles', exist_ok=True)
+            step_metrics.dump_profile(f'colorful/logs/profiles/log{log_id}_{index:03d}.prof')
+        if write_records:
+            records.write(interaction_record(colors, target_index, input, naive_prediction, context_prediction, outcome,
+                                             {'fit_colors': fit_time, 'learning': learn_time}, step_metrics.as_dict(), learn_mode))
 
         if show_steps:
             gui.draw(colors, target_index, input)
-            visualization.show(model.model, model_before)
+            visualization.show(color_model.model, model_before)
+        if render_steps:
+            renderer.render(color_model.model, model_before, colors, target_index, input)
 
     if show_model:
-        visualization.show(model.model, model.base_model)
+        visualization.show(color_model.model, color_model.base_model)
+
+    if render_steps:
+        renderer.save_animation(f'colorful/frames/log{log_id}.gif')
+    if write_records:
+        records.close()
+    fileh.close()
+    log.removeHandler(fileh)
+    return log_file
+
+def simulation_log_id(origin_id, learn_mode, name_appendix):
+    if learn_mode == 'statistical':
+        log_id = origin_id + 1000
+    elif learn_mode == 'naive':
+        log_id = origin_id + 2000
+    elif learn_mode == 'context-sensitive':
+        log_id = origin_id + 3000
+    else:
+        raise Exception("Error: Invalid Learning Mode!")
+
+    return f'{log_id}{name_appendix}'
+
+def simulate_batch(origin_ids, learn_modes, change_limits=[change_limit], shuffles=[shuffle], doubles=[double],
+                   seeds={name_appendix: None}, lower_bounds=[model.lower_bound], processes=None, write_records=write_records, text_log=text_log):
+    jobs = []
+    for origin_id, learn_mode, limit, shuffled, doubled, (appendix, seed), bound in itertools.product(
+            origin_ids, learn_modes, change_limits, shuffles, doubles, seeds.items(), lower_bounds):
+        jobs.append({'origin_id': origin_id, 'learn_mode': learn_mode, 'name_appendix': appendix, 'double': doubled, 'shuffle': shuffled,
+                     'show_steps': False, 'show_model': False, 'change_limit': limit, 'seed': seed, 'lower_bound': bound,
+                     'write_records': write_records, 'text_log': text_log, 'render_steps': False, 'profile_steps': False})
+
+    log_ids = [simulation_log_id(job['origin_id'], job['learn_mode'], job['name_appendix']) for job in jobs]
+    if len(set(log_ids)) != len(log_ids):
+        raise Exception("Error: Several simulations would write the same log file, use distinct seed keys!")
+
+    with ProcessPoolExecutor(processes) as executor:
+        for log_file in executor.map(_simulate_quiet, jobs):
+            print(f"Finished {log_file}")
+
+def bootstrap_model(origin_ids, change_limit=change_limit, save_id=None):
+    color_model = model.ColorModel()
+    observations = [observation for origin_id in origin_ids for observation in logdecoder.decode_observations(origin_id)]
+    outcomes = color_model.statistical_batch(observations, change_limit)
+
+    changed = sum(outcome['status'] == 'changed' for outcome in outcomes)
+    print(f"Learned {changed} of {len(outcomes)} observations")
+    if save_id is not None:
+        color_model.save_model(save_id)
+    return color_model, outcomes
+
+def _simulate_quiet(job):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return simulate(**job)
 
 
 if __name__ == '__main__':
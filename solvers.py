@@ -0,0 +1,138 @@
+import itertools
+import numpy as np
+
+
+"""
+Solvers for the border change minimization of learning.LearningSession, selected by learning.default_solver or per learning call:
+
+'slsqp': scipy.optimize.minimize (SLSQP) with the analytic gradients
+'gauss-newton': minimize_border_change below, a sequential quadratic method specialized on the problem
+'auto': gauss-newton, SLSQP if it is not successful
+"""
+
+
+max_iterations = 50
+# highest allowed violation of a constraint by a solution
+feasibility_tolerance = 1e-8
+# added to the diagonal of the Gauss-Newton matrix, the objective is flat in clamped directions
+regularization = 1e-6
+# with more constraints the quadratic subproblems are not solved by enumerating the active sets
+max_constraints = 8
+# the minimization is stopped if the penalty function decreased less than stall_decrease (relative) in stall_iterations
+stall_iterations = 10
+stall_decrease = 1e-3
+
+
+class SolverResult(dict):
+    # the fields of scipy.optimize.OptimizeResult that are used by the learning, with attribute access
+    def __getattr__(self, name):
+        # AttributeError like OptimizeResult, so that getattr(result, name, default) and hasattr() work
+        try:
+            return self[name]
+        except KeyError as error:
+            raise AttributeError(name) from error
+
+    def __repr__(self):
+        return '\n'.join(f"{key:>8}: {value}" for key, value in self.items())
+
+
+def minimize_border_change(fun, x0: np.ndarray, jac, hessian, constraints: list[dict], tol=1e-6, max_iterations=max_iterations, step_limit=None):
+    """
+    Minimizes the sum of squared border changes subject to inequality constraints (scipy's dict format with fun, jac and args).
+    The borders are linear in the offsets apart from clamps and hue wrap, so the objective is modeled by its
+    Gauss-Newton matrix (hessian) and the few constraints are linearized in every iteration. The resulting quadratic
+    problems are solved exactly by trying all active sets of the constraints, the step is chosen by a backtracking
+    line search on an l1 penalty function. step_limit(x, step) can return the step length up to which the
+    Gauss-Newton model is valid (e.g. the next clamp), longer steps are cut there.
+    """
+    if len(constraints) > max_constraints:
+        # e.g. many labeled objects in one scene, the active sets are not enumerated (see 'auto')
+        return SolverResult(x=np.array(x0, dtype=float), fun=fun(x0), success=False, message=f"More than {max_constraints} constraints", nit=0, nfev=1, njev=0)
+
+    counter = {'nfev': 0, 'njev': 0}
+
+    def evaluate(x):
+        counter['nfev'] += 1
+        return fun(x), np.array([constraint['fun'](x, *constraint['args']) for constraint in constraints])
+
+    def gradients(x):
+        counter['njev'] += 1
+        return jac(x), np.array([constraint['jac'](x, *constraint['args']) for constraint in constraints]).reshape(len(constraints), -1)
+
+    x = np.array(x0, dtype=float)
+    value, values = evaluate(x)
+    penalty = 1.0
+    message = "Iteration limit reached"
+    iteration = 0
+    success = False
+
+    gradient, constraint_gradients = gradients(x)
+    history = []
+
+    for iteration in range(1, max_iterations + 1):
+        matrix = hessian(x) + regularization * np.eye(len(x))
+        step, multipliers = _solve_quadratic(matrix, gradient, constraint_gradients, values)
+        if step is None:
+            message = "Linearized constraints are inconsistent"
+            break
+
+        penalty = max(penalty, 2 * multipliers.max(initial=0))
+        merit = value + penalty * np.maximum(-values, 0).sum()
+        # decrease of the merit function predicted by the linearization
+        predicted = gradient @ step - penalty * np.maximum(-values, 0).sum()
+
+        alpha = 1.0 if step_limit is None else step_limit(x, step)
+        for _ in range(30):
+            new_value, new_values = evaluate(x + alpha * step)
+            if new_value + penalty * np.maximum(-new_values, 0).sum() <= merit + 1e-4 * alpha * min(predicted, 0):
+                break
+            alpha /= 2
+        x = x + alpha * step
+        value, values = new_value, new_values
+        gradient, constraint_gradients = gradients(x)
+
+        if np.abs(step).max(initial=0) < tol and np.all(values >= -feasibility_tolerance):
+            success = True
+            message = "Optimization terminated successfully"
+            break
+
+        history.append((value, np.maximum(-values, 0).sum()))
+        if len(history) > stall_iterations:
+            earlier, current = (value + penalty * violation for value, violation in (history[-stall_iterations - 1], history[-1]))
+            if current > (1 - stall_decrease) * earlier:
+                message = "Stalled, the penalty function does not decrease"
+                break
+
+    return SolverResult(x=x, fun=value, success=success, message=message, nit=iteration, nfev=counter['nfev'], njev=counter['njev'])
+
+def _solve_quadratic(matrix: np.ndarray, gradient: np.ndarray, constraint_gradients: np.ndarray, values: np.ndarray):
+    """
+    min 0.5 d^T matrix d + gradient^T d  s.t.  constraint_gradients d + values >= 0
+    The matrix is positive definite, so the solution is the only KKT point. It is found by trying all active sets.
+    """
+    size, number = len(gradient), len(values)
+    if number > max_constraints:
+        raise Exception(f"Error: The Gauss-Newton solver supports at most {max_constraints} constraints!")
+
+    best = None
+    for active_number in range(number + 1):
+        for active in itertools.combinations(range(number), active_number):
+            active = list(active)
+            A = constraint_gradients[active]
+            kkt = np.block([[matrix, -A.T], [A, np.zeros((active_number, active_number))]])
+            try:
+                solution = np.linalg.solve(kkt, np.concatenate([-gradient, -values[active]]))
+            except np.linalg.LinAlgError:
+                continue
+            step, active_multipliers = solution[:size], solution[size:]
+
+            if np.all(active_multipliers >= -1e-10) and np.all(constraint_gradients @ step + values >= -1e-9):
+                objective = 0.5 * step @ matrix @ step + gradient @ step
+                if best is None or objective < best[0]:
+                    multipliers = np.zeros(number)
+                    multipliers[active] = active_multipliers
+                    best = (objective, step, multipliers)
+
+    if best is None:
+        return None, None
+    return best[1], best[2]
@@ -0,0 +1,17 @@
+import pytest
+
+import benchmark
+
+
+"""
+Checks that the entry points start fast: importing them must not load the heavy modules (they are loaded on first use)
+and must stay within the import time budget. Run from the directory containing colorful:
+        python -m pytest colorful/test_imports.py
+"""
+
+
+@pytest.mark.parametrize('module', benchmark.import_modules)
+def test_import(module):
+    result = benchmark.measure_import(module)
+    assert result['heavy_modules'] == [], f"Importing {module} loads {', '.join(result['heavy_modules'])}"
+    assert result['seconds'] <= benchmark.import_time_budget, f"Importing {module} takes {result['seconds']:.3f}s, the budget is {benchmark.import_time_budget}s"
@@ -1,7 +1,7 @@
+import os
+from functools import lru_cache
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from colorsys import hls_to_rgb
 
 delta = 0.25
 hue = np.arange(0, 360, delta)
@@ -13,16 +13,34 @@ linewidths_show = [1.5, 0.3, 0.3]
 levels_compare = levels_show[0:1]
 linewidths_compare = linewidths_show[0:1]
 
-background = np.empty(len(hue) * len(lightness) * 3)
-for y, l in enumerate(lightness):
-    for x, h in enumerate(hue):
-        r, g, b = hls_to_rgb(h / 360.0, l / 100.0, 1)
-        idx = (y * len(hue) + x) * 3
-        background[idx] = r
-        background[idx + 1] = g
-        background[idx + 2] = b
-
-background = background.reshape(len(lightness), len(hue), 3)
+background_path = 'colorful/.cache/background.npy'
+_background = None
+
+def get_background():
+    # computed on first use and cached on disk, later runs only memory-map the file
+    global _background
+    if _background is None:
+        shape = (len(lightness), len(hue), 3)
+        if os.path.exists(background_path):
+            _background = np.load(background_path, mmap_mode='r')
+        if _background is None or _background.shape != shape:
+            _background = hls_to_rgb(Hue / 360.0, Lightness / 100.0, 1)
+            os.makedirs(os.path.dirname(background_path), exist_ok=True)
+            np.save(background_path, _background)
+    return _background
+
+def hls_to_rgb(h: np.ndarray, l: np.ndarray, s: float):
+    # vectorized colorsys.hls_to_rgb
+    m2 = np.where(l <= 0.5, l * (1.0 + s), l + s - (l * s))
+    m1 = 2.0 * l - m2
+    rgb = np.stack([_hls_value(m1, m2, h + 1.0 / 3.0), _hls_value(m1, m2, h), _hls_value(m1, m2, h - 1.0 / 3.0)], axis=-1)
+    if s == 0.0:
+        rgb[:] = l[..., np.newaxis]
+    return rgb
+
+def _hls_value(m1: np.ndarray, m2: np.ndarray, hue: np.ndarray):
+    hue = hue % 1.0
+    return np.select([hue < 1.0 / 6.0, hue < 0.5, hue < 2.0 / 3.0], [m1 + (m2 - m1) * hue * 6.0, m2, m1 + (m2 - m1) * (2.0 / 3.0 - hue) * 6.0], m1)
 
 def translate_color(color_label: str):
     if color_label == 'rot':
@@ -52,17 +70,51 @@ def translate_color(color_label: str):
     else:
         return 'black'
 
-def _plot(ax: plt.Axes, row: pd.Series, contour_color: str, linestyles: str, linewidths=linewidths_show, levels=levels_show, hue_offset=0):
-    Values = np.exp(-0.5 * (((Hue - (row['hc'] + hue_offset)) / row['hr']) ** 2 + 0 + ((Lightness - row['lc']) / row['lr']) ** 2))
-    ax.contour(Hue, Lightness, Values, colors=contour_color, levels=levels, linewidths=linewidths, linestyles=linestyles)
+@lru_cache(maxsize=512)
+def _field(hc, hr, lc, lr, outer_level):
+    """
+    Evaluates a prototype only on the part of the grid its outer contour level can reach.
+    The results are cached, so unchanged prototypes (e.g. of the base model) are evaluated once.
+    """
+    if np.isnan([hc, hr, lc, lr]).any():
+        return None
+
+    # the outer level is reached at this multiple of the radii
+    reach = np.sqrt(-2 * np.log(outer_level))
+    hue_slice = _grid_slice(hue, hc - reach * hr, hc + reach * hr)
+    lightness_slice = _grid_slice(lightness, lc - reach * lr, lc + reach * lr)
+    if hue_slice.stop - hue_slice.start < 2 or lightness_slice.stop - lightness_slice.start < 2:
+        return None
+
+    Hue_part = Hue[lightness_slice, hue_slice]
+    Lightness_part = Lightness[lightness_slice, hue_slice]
+    Values = np.exp(-0.5 * (((Hue_part - hc) / hr) ** 2 + 0 + ((Lightness_part - lc) / lr) ** 2))
+    return Hue_part, Lightness_part, Values
+
+def _grid_slice(axis: np.ndarray, low, high):
+    # indices of the axis covering [low, high] with a margin of two grid points
+    start = max(int(np.floor((low - axis[0]) / delta)) - 2, 0)
+    stop = min(int(np.ceil((high - axis[0]) / delta)) + 3, len(axis))
+    return slice(start, max(start, stop))
+
+def _plot(ax, row: pd.Series, contour_color: str, linestyles: str, linewidths=linewidths_show, levels=levels_show, hue_offset=0):
+    artists = []
+    field = _field(float(row['hc'] + hue_offset), float(row['hr']), float(row['lc']), float(row['lr']), float(min(levels)))
+    if field is not None:
+        artists.append(ax.contour(*field, colors=contour_color, levels=levels, linewidths=linewidths, linestyles=linestyles))
 
     if hue_offset == 0:
         if row['hc'] - row['hr'] < 0:
-            _plot(ax, row, contour_color, linestyles, linewidths, levels, 360)
+            artists += _plot(ax, row, contour_color, linestyles, linewidths, levels, 360)
         if row['hc'] + row['hr'] > 360:
-            _plot(ax, row, contour_color, linestyles, linewidths, levels, -360)
+            artists += _plot(ax, row, contour_color, linestyles, linewidths, levels, -360)
+
+    return artists
 
 def show(model: pd.DataFrame, base_model: pd.DataFrame = None, xlim=[0, 360]):
+    # matplotlib is only imported when something is plotted
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
     fig.set_size_inches(14, 7)
 
@@ -84,7 +136,7 @@ def show(model: pd.DataFrame, base_model: pd.DataFrame = None, xlim=[0, 360]):
         _plot(ax, row, contour_color, 'solid', linewidths=linewidths, levels=levels)
 
 
-    plt.imshow(background, extent=[0, 360, 0, 100], origin='lower')
+    plt.imshow(get_background(), extent=[0, 360, 0, 100], origin='lower')
     plt.xticks(np.arange(0, 361, 30))
     plt.xlim(xlim)
     
@@ -93,3 +145,76 @@ def show(model: pd.DataFrame, base_model: pd.DataFrame = None, xlim=[0, 360]):
 
     plt.savefig("output.png",bbox_inches='tight')
     plt.show()
+
+
+
+class FrameRenderer:
+    """
+    Renders the steps of a simulation without a display into numbered frames (frame000.png, ...)
+    and optionally an animated GIF. Like show(model, model_before) every frame shows the model before
+    the step dotted and the model after the step solid, together with the colors of the scene.
+    The figure is reused and only the contours of prototypes that changed are redrawn.
+    """
+
+    def __init__(self, output_dir, dpi=50):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.output_dir = output_dir
+        self.frames = []
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.figure = Figure(figsize=(14, 4.5), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        # a coarser 8 bit copy of the background is enough for the frames and much faster to draw
+        background = np.round(get_background()[::2, ::2] * 255).astype(np.uint8)
+        self.ax.imshow(background, extent=[0, 360, 0, 100], origin='lower')
+        self.ax.set_xticks(np.arange(0, 361, 30))
+        self.ax.set_xlim([0, 360])
+        self.ax.set_xlabel("Hue (Degrees)")
+        self.ax.set_ylabel("Lightness (%)")
+        self.ax.set_title(' ')
+        self.figure.tight_layout()
+
+        # drawn parameters and contour artists per (colorname, linestyle)
+        self.contours = {}
+        self.scene = None
+
+    def render(self, model: pd.DataFrame, model_before: pd.DataFrame, colors=(), target_index=None, title=''):
+        for linestyle, used_model in (('dotted', model_before), ('solid', model)):
+            for colorname, row in used_model.iterrows():
+                self._update_contour(colorname, row, linestyle)
+
+        if self.scene is not None:
+            self.scene.remove()
+        sizes = [300 if i == target_index else 120 for i in range(len(colors))]
+        self.scene = self.ax.scatter([c.h for c in colors], [c.l for c in colors], s=sizes, c=[c.html() for c in colors], edgecolors='black', linewidths=2, zorder=3)
+        self.ax.set_title(title)
+
+        path = f'{self.output_dir}/frame{len(self.frames):03d}.png'
+        # drawn once and written directly, savefig would draw the figure twice
+        self.figure.canvas.draw()
+        from PIL import Image
+        Image.fromarray(np.asarray(self.figure.canvas.buffer_rgba())).save(path)
+        self.frames.append(path)
+        return path
+
+    def _update_contour(self, colorname, row: pd.Series, linestyle: str):
+        key = (colorname, linestyle)
+        parameters = tuple(row[['hc', 'hr', 'lc', 'lr']])
+        if key in self.contours and np.array_equal(self.contours[key][0], parameters, equal_nan=True):
+            return
+
+        if key in self.contours:
+            for artist in self.contours[key][1]:
+                artist.remove()
+        artists = _plot(self.ax, row, translate_color(colorname), linestyle, linewidths=linewidths_compare, levels=levels_compare)
+        self.contours[key] = (parameters, artists)
+
+    def save_animation(self, path, duration=500):
+        from PIL import Image
+
+        if self.frames:
+            images = [Image.open(frame) for frame in self.frames]
+            images[0].save(path, save_all=True, append_images=images[1:], duration=duration, loop=0)